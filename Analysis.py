@@ -0,0 +1,205 @@
+# Batch analysis: positions stream through a pool of worker processes and results stream back, in input order or as
+# they finish. With a cache file, positions already searched at least as deep are answered from it without a search
+# Usage: python Analysis.py positions.epd [more.epd ...|-] [--depth 6] [--movetime 5] [--nodes 100000] [--workers 4]
+#        [--cache analysis.db] [--unordered] [--output results.jsonl]
+# Lines are FENs or EPDs, the EPD operations acd, acs and acn set the depth, seconds and nodes of their own position
+
+import argparse
+import json
+import multiprocessing
+import queue
+import sys
+import time
+import ChessEngine
+import EPD
+import MoveFinder
+import SearchCache
+from PGN import moveToSAN
+from UCI import uciNotation
+
+WINDOW_PER_WORKER = 4 # Positions read ahead per worker, so a stream of any length is analyzed in bounded memory
+
+# FEN of a FEN or EPD line and its EPD operations
+def parsePosition(line):
+    fields = line.split(None, 6)
+    if len(fields) >= 6 and fields[4].isdigit() and fields[5].isdigit():
+        operations = EPD.parseEPD(' '.join(fields[:4] + fields[6:]))[1]
+        return ' '.join(fields[:6]), operations
+    return EPD.parseEPD(line)
+
+# (maxDepth, timeLimit, nodeLimit) of a position: its EPD operations first, then the batch limits, then MoveFinder's
+def positionLimits(operations, limits):
+    maxDepth, timeLimit, nodeLimit = limits
+    if 'acd' in operations:
+        maxDepth = int(operations['acd'][0])
+    if 'acs' in operations:
+        timeLimit = float(operations['acs'][0])
+    if 'acn' in operations:
+        nodeLimit = int(operations['acn'][0])
+    return MoveFinder.searchLimits(maxDepth, timeLimit, nodeLimit)
+
+# SAN of a line of packed moves from gs, up to the first one that isn't legal. gs ends where it started
+def lineToSAN(gs, line):
+    sans = []
+    for packed in line:
+        validMoves = gs.getValidMoves()
+        move = next((move for move in validMoves if move.packed == packed), None)
+        if move is None:
+            break
+        sans.append(moveToSAN(gs, move, validMoves))
+        gs.makeMove(move)
+    for i in range(len(sans)):
+        gs.undoMove()
+    return sans
+
+# Searches one position. The transposition table is kept from one position to the next, batches often hold
+# positions of the same games. Returns the result and the entry to cache, None when there is nothing to cache
+def analyzeTask(task):
+    index, positionId, fen, limits = task
+    gs = ChessEngine.GameState()
+    gs.loadFEN(fen)
+    result = {'index': index, 'id': positionId, 'fen': fen}
+    validMoves = gs.getValidMoves()
+    if len(validMoves) == 0:
+        result.update({'source': 'checkmate' if gs.inCheck else 'stalemate', 'move': None, 'uci': None,
+                       'score': -MoveFinder.CHECKMATE if gs.inCheck else MoveFinder.STALEMATE, 'depth': 0, 'pv': []})
+        return result, None
+    startTime = time.time()
+    move, stats = MoveFinder.findBestMoveWithStats(gs, validMoves, *limits)
+    seconds = time.time() - startTime
+    if move is None: # Depth 1 always finishes, this only guards against reporting no move
+        move = validMoves[0]
+    source = stats.source if stats is not None else 'search'
+    score = stats.score if stats is not None else None
+    if source == 'tablebase':
+        score = MoveFinder.tablebaseScore(gs)
+    pv = stats.pv if stats is not None and stats.pv and stats.pv[0] == move.packed else [move.packed]
+    result.update({'source': source, 'move': moveToSAN(gs, move, validMoves), 'uci': uciNotation(move), 'score': score,
+                   'depth': stats.depth if stats is not None else None, 'pv': lineToSAN(gs, pv),
+                   'nodes': stats.nodes if stats is not None else None, 'seconds': round(seconds, 3)})
+    entry = None
+    if source == 'search' and stats is not None and stats.depth > 0:
+        # The search stops at the depth that proves a mate, the result holds however deep the position is asked for again
+        depth = max(stats.depth, limits[0]) if abs(stats.score) >= MoveFinder.CHECKMATE else stats.depth
+        entry = (gs.zobristKey, move.packed, stats.score, depth, pv)
+    return result, entry
+
+# Result of a position answered by the cache, or of one that can't be analyzed. None when it has to be searched,
+# then the task to search it comes second
+def preparePosition(index, position, limits, cache):
+    line, ownLimits = position if isinstance(position, tuple) else (position, limits)
+    try:
+        fen, operations = parsePosition(line)
+        gs = ChessEngine.GameState()
+        gs.loadFEN(fen)
+        maxDepth, timeLimit, nodeLimit = positionLimits(operations, ownLimits)
+    except (ValueError, KeyError, IndexError) as error:
+        return {'index': index, 'error': str(error)}, None
+    positionId = ' '.join(operations['id']) if 'id' in operations else None
+    if cache is not None:
+        entry = cache.probe(gs.zobristKey)
+        if entry is not None and entry[2] >= maxDepth:
+            move, score, depth, pv = entry
+            validMoves = gs.getValidMoves()
+            for validMove in validMoves:
+                if validMove.packed == move: # A different move means a key collision, search it again
+                    return {'index': index, 'id': positionId, 'fen': fen, 'source': 'cache',
+                            'move': moveToSAN(gs, validMove, validMoves), 'uci': uciNotation(validMove), 'score': score,
+                            'depth': depth, 'pv': lineToSAN(gs, pv)}, None
+    return None, (index, positionId, fen, (maxDepth, timeLimit, nodeLimit))
+
+# Yields a result dict for every position, in input order when ordered, otherwise as soon as it is ready.
+# A position is a FEN or EPD line, or a (line, limits) pair to override the batch limits for it
+def analyzePositions(positions, limits=(None, None, None), workers=None, cachePath=None, ordered=True):
+    workers = multiprocessing.cpu_count() if workers is None else workers
+    cache = SearchCache.SearchCache(cachePath) if cachePath is not None else None
+    finished = queue.Queue() # (result, cache entry) pairs from the pool's result thread, or the exception of a task
+    ready = {} # Finished results waiting for those before them when ordered
+    nextIndex = 0
+    pending = 0 # Read and not handed out yet
+    positions = enumerate(positions)
+    exhausted = False
+    pool = multiprocessing.Pool(workers, initializer=MoveFinder.initPoolWorker)
+    try:
+        while True:
+            while not exhausted and pending < workers * WINDOW_PER_WORKER:
+                item = next(positions, None)
+                if item is None:
+                    exhausted = True
+                    break
+                pending += 1
+                result, task = preparePosition(item[0], item[1], limits, cache)
+                if result is not None:
+                    finished.put((result, None))
+                else:
+                    pool.apply_async(analyzeTask, (task,), callback=finished.put, error_callback=finished.put)
+            if pending == 0:
+                break
+            item = finished.get()
+            if isinstance(item, BaseException):
+                raise item
+            result, entry = item
+            if entry is not None and cache is not None:
+                cache.store(*entry)
+            if ordered:
+                ready[result['index']] = result
+                while nextIndex in ready:
+                    pending -= 1
+                    yield ready.pop(nextIndex)
+                    nextIndex += 1
+            else:
+                pending -= 1
+                yield result
+    finally:
+        pool.terminate()
+        pool.join()
+        if cache is not None:
+            cache.close()
+
+# Lines of the files, '-' reads standard input. Read as they are needed
+def readPositions(paths):
+    for path in paths:
+        f = sys.stdin if path == '-' else open(path)
+        try:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    yield line
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze a batch of FEN or EPD positions in parallel")
+    parser.add_argument('positions', nargs='+', help="FEN or EPD files, - for standard input")
+    parser.add_argument('--depth', type=int, help="Depth per position, MoveFinder.DEPTH when no limit is given")
+    parser.add_argument('--movetime', type=float, help="Seconds per position")
+    parser.add_argument('--nodes', type=int, help="Nodes per position")
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--cache', help="SQLite file of earlier results, positions searched at least as deep aren't searched again")
+    parser.add_argument('--unordered', action='store_true', help="Write results as they finish instead of in input order")
+    parser.add_argument('--output', help="Write the results, one JSON object per line, to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    output = open(args.output, 'w') if args.output else sys.stdout
+    counts = {}
+    startTime = time.time()
+    try:
+        for result in analyzePositions(readPositions(args.positions), (args.depth, args.movetime, args.nodes), args.workers,
+                                       args.cache, not args.unordered):
+            source = 'error' if 'error' in result else result['source']
+            counts[source] = counts.get(source, 0) + 1
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    seconds = time.time() - startTime
+    total = sum(counts.values())
+    sys.stderr.write(str(total) + " positions in " + format(seconds, '.1f') + "s (" +
+                     format(total / seconds if seconds > 0 else 0, '.2f') + "/s): " +
+                     ", ".join(source + " " + str(count) for source, count in sorted(counts.items())) + "\n")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
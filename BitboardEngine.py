@@ -0,0 +1,331 @@
+# Bitboard backed GameState. Keeps a 64-bit occupancy per piece type and color and generates legal moves from them
+import ChessEngine
+from ChessEngine import PIECE_NAMES, PIECE_CODES, PROMOTION, EN_PASSANT, MOVED_SHIFT, CAPTURED_SHIFT, EMPTY, SQUARE120, SQUARE64, NULL_MOVE
+
+# Squares are indexed row * 8 + col, so a8 is 0 and h1 is 63 (the order of ChessEngine.SQUARE120 into the mailbox)
+SQUARES = [(sq // 8, sq % 8) for sq in range(64)]
+FULL = (1 << 64) - 1
+PIECES = ['wP', 'wR', 'wN', 'wB', 'wQ', 'wK', 'bP', 'bR', 'bN', 'bB', 'bQ', 'bK']
+MOVED = {piece: code << MOVED_SHIFT for piece, code in PIECE_CODES.items()}
+CAPTURED = {piece: code << CAPTURED_SHIFT for piece, code in PIECE_CODES.items()}
+
+# Directions as (row, col) steps. A direction is "positive" when it increases the square index
+ROOK_DIRECTIONS = [(-1, 0), (0, -1), (1, 0), (0, 1)]
+BISHOP_DIRECTIONS = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+
+def _onBoard(r, c):
+    return 0 <= r < 8 and 0 <= c < 8
+
+def _stepAttacks(steps):
+    table = []
+    for r, c in SQUARES:
+        mask = 0
+        for dr, dc in steps:
+            if _onBoard(r + dr, c + dc):
+                mask |= 1 << ((r + dr) * 8 + c + dc)
+        table.append(mask)
+    return table
+
+def _rays(d):
+    table = []
+    for r, c in SQUARES:
+        mask = 0
+        for i in range(1, 8):
+            if not _onBoard(r + d[0] * i, c + d[1] * i):
+                break
+            mask |= 1 << ((r + d[0] * i) * 8 + c + d[1] * i)
+        table.append(mask)
+    return table
+
+KNIGHT_ATTACKS = _stepAttacks([(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)])
+KING_ATTACKS = _stepAttacks([(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)])
+PAWN_ATTACKS = {'w': _stepAttacks([(-1, -1), (-1, 1)]), 'b': _stepAttacks([(1, -1), (1, 1)])}
+# (rays, positive) per direction. The nearest blocker on a positive ray is its lowest set bit, otherwise its highest
+ROOK_RAYS = [(_rays(d), d[0] > 0 or (d[0] == 0 and d[1] > 0)) for d in ROOK_DIRECTIONS]
+BISHOP_RAYS = [(_rays(d), d[0] > 0) for d in BISHOP_DIRECTIONS]
+
+# Squares strictly between two squares on a shared line, 0 if they are not aligned
+BETWEEN = [[0] * 64 for _ in range(64)]
+for _d in ROOK_DIRECTIONS + BISHOP_DIRECTIONS:
+    for _r, _c in SQUARES:
+        _mask = 0
+        for _i in range(1, 8):
+            _er, _ec = _r + _d[0] * _i, _c + _d[1] * _i
+            if not _onBoard(_er, _ec):
+                break
+            BETWEEN[_r * 8 + _c][_er * 8 + _ec] = _mask
+            _mask |= 1 << (_er * 8 + _ec)
+
+def slidingAttacks(sq, occupied, rays):
+    attacks = 0
+    for table, positive in rays:
+        ray = table[sq]
+        blockers = ray & occupied
+        if blockers:
+            if positive:
+                blocker = (blockers & -blockers).bit_length() - 1
+            else:
+                blocker = blockers.bit_length() - 1
+            ray ^= table[blocker]
+        attacks |= ray
+    return attacks
+
+def _firstBlocker(table, positive, sq, occupied):
+    blockers = table[sq] & occupied
+    if not blockers:
+        return -1
+    if positive:
+        return (blockers & -blockers).bit_length() - 1
+    return blockers.bit_length() - 1
+
+
+class BitboardGameState(ChessEngine.GameState):
+    def __init__(self):
+        super().__init__()
+        self.loadBitboards()
+
+    def loadFEN(self, fen):
+        super().loadFEN(fen)
+        self.loadBitboards()
+
+    def loadBitboards(self):
+        self.bitboards = {piece: 0 for piece in PIECES}
+        self.occupancy = {'w': 0, 'b': 0}
+        for sq, mailboxSq in enumerate(SQUARE120):
+            piece = self.board[mailboxSq]
+            if piece != EMPTY:
+                self.bitboards[PIECE_NAMES[piece]] |= 1 << sq
+                self.occupancy[PIECE_NAMES[piece][0]] |= 1 << sq
+
+    def makeMove(self, move):
+        if move.__class__ is not int:
+            move = move.packed
+        super().makeMove(move)
+        self.toggleBitboards(move)
+
+    def undoMove(self):
+        if len(self.movesLog) != 0:
+            if self.movesLog[-1] != NULL_MOVE: # A null move leaves every piece where it was
+                self.toggleBitboards(self.movesLog[-1])
+            super().undoMove()
+
+    # XOR is its own inverse, so the same update is used to make and to unmake a move
+    def toggleBitboards(self, move):
+        bitboards = self.bitboards
+        pieceMoved = PIECE_NAMES[move >> MOVED_SHIFT & 15]
+        color = pieceMoved[0]
+        startSq = move & 63
+        endSq = move >> 6 & 63
+        startBit = 1 << startSq
+        endBit = 1 << endSq
+        bitboards[pieceMoved] ^= startBit
+        if move & PROMOTION:
+            bitboards[color + 'Q'] ^= endBit
+        else:
+            bitboards[pieceMoved] ^= endBit
+        self.occupancy[color] ^= startBit | endBit
+        captured = move >> CAPTURED_SHIFT & 15
+        if captured:
+            if move & EN_PASSANT:
+                captureBit = 1 << (startSq & 56 | endSq & 7)
+            else:
+                captureBit = endBit
+            pieceCaptured = PIECE_NAMES[captured]
+            bitboards[pieceCaptured] ^= captureBit
+            self.occupancy[pieceCaptured[0]] ^= captureBit
+        if move & ChessEngine.CASTLE:
+            if endSq - startSq == 2: # Kingside castle
+                rookBits = (endBit << 1) | (endBit >> 1)
+            else: # Queenside castle
+                rookBits = (endBit >> 2) | (endBit << 1)
+            bitboards[color + 'R'] ^= rookBits
+            self.occupancy[color] ^= rookBits
+
+    def attackersTo(self, sq, byColor, occupied):
+        bitboards = self.bitboards
+        queens = bitboards[byColor + 'Q']
+        attackers = KNIGHT_ATTACKS[sq] & bitboards[byColor + 'N']
+        attackers |= KING_ATTACKS[sq] & bitboards[byColor + 'K']
+        # A square is attacked by a pawn of one color from where a pawn of the other color would attack
+        attackers |= PAWN_ATTACKS['b' if byColor == 'w' else 'w'][sq] & bitboards[byColor + 'P']
+        rooks = bitboards[byColor + 'R'] | queens
+        if rooks:
+            attackers |= slidingAttacks(sq, occupied, ROOK_RAYS) & rooks
+        bishops = bitboards[byColor + 'B'] | queens
+        if bishops:
+            attackers |= slidingAttacks(sq, occupied, BISHOP_RAYS) & bishops
+        return attackers
+
+    def isAttacked(self, sq, byColor, occupied):
+        bitboards = self.bitboards
+        if KNIGHT_ATTACKS[sq] & bitboards[byColor + 'N'] or KING_ATTACKS[sq] & bitboards[byColor + 'K']:
+            return True
+        if PAWN_ATTACKS['b' if byColor == 'w' else 'w'][sq] & bitboards[byColor + 'P']:
+            return True
+        queens = bitboards[byColor + 'Q']
+        rooks = bitboards[byColor + 'R'] | queens
+        if rooks and slidingAttacks(sq, occupied, ROOK_RAYS) & rooks:
+            return True
+        bishops = bitboards[byColor + 'B'] | queens
+        if bishops and slidingAttacks(sq, occupied, BISHOP_RAYS) & bishops:
+            return True
+        return False
+
+    def squareUnderAttack(self, sq, white):
+        return self.isAttacked(SQUARE64[sq], 'b' if white else 'w', self.occupancy['w'] | self.occupancy['b'])
+
+    def getPinnedPieces(self, kingSq, allyColor, enemyColor, occupied):
+        pins = {} # square of pinned piece -> squares it may still move to
+        allies = self.occupancy[allyColor]
+        queens = self.bitboards[enemyColor + 'Q']
+        for rays, sliders in ((ROOK_RAYS, self.bitboards[enemyColor + 'R'] | queens),
+                              (BISHOP_RAYS, self.bitboards[enemyColor + 'B'] | queens)):
+            if not sliders:
+                continue
+            for table, positive in rays:
+                if not table[kingSq] & sliders:
+                    continue
+                first = _firstBlocker(table, positive, kingSq, occupied)
+                if first < 0 or not (allies >> first) & 1:
+                    continue
+                second = _firstBlocker(table, positive, first, occupied)
+                if second >= 0 and (sliders >> second) & 1:
+                    pins[first] = BETWEEN[kingSq][second] | (1 << second)
+        return pins
+
+    # The inherited mailbox generators test en passant with the board alone, which squareUnderAttack doesn't read here
+    def isLegalMove(self, move):
+        if move & EN_PASSANT:
+            return move in self.generateLegalMoves(False)
+        return super().isLegalMove(move)
+
+    # Legal moves as packed ints, also sets checkMate and staleMate
+    def generateMoves(self):
+        moves = self.generateLegalMoves(False)
+        self.checkMate = len(moves) == 0 and self.inCheck
+        self.staleMate = len(moves) == 0 and not self.inCheck
+        return moves
+
+    # Captures and promotions only, or every evasion when in check
+    def generateCaptures(self):
+        moves = self.generateLegalMoves(True)
+        if self.inCheck:
+            self.checkMate = len(moves) == 0
+        else:
+            self.checkMate = False
+        self.staleMate = False
+        return moves
+
+    def generateLegalMoves(self, capturesOnly):
+        moves = []
+        board = self.board
+        bitboards = self.bitboards
+        if self.whiteToMove:
+            allyColor, enemyColor = 'w', 'b'
+        else:
+            allyColor, enemyColor = 'b', 'w'
+        allies = self.occupancy[allyColor]
+        enemies = self.occupancy[enemyColor]
+        occupied = allies | enemies
+        kingBit = bitboards[allyColor + 'K']
+        kingSq = kingBit.bit_length() - 1
+        checkers = self.attackersTo(kingSq, enemyColor, occupied)
+        self.inCheck = checkers != 0
+        capturesOnly = capturesOnly and not checkers
+
+        # King steps are tested with the king removed so it cannot hide behind itself on a checking ray
+        kingTargets = KING_ATTACKS[kingSq] & (enemies if capturesOnly else ~allies)
+        occupiedWithoutKing = occupied ^ kingBit
+        kingMove = MOVED[allyColor + 'K'] | kingSq
+        while kingTargets:
+            bit = kingTargets & -kingTargets
+            kingTargets ^= bit
+            sq = bit.bit_length() - 1
+            if not self.isAttacked(sq, enemyColor, occupiedWithoutKing):
+                if bit & enemies: # The board is only read for captures
+                    moves.append(kingMove | sq << 6 | board[SQUARE120[sq]] << CAPTURED_SHIFT)
+                else:
+                    moves.append(kingMove | sq << 6)
+
+        if (checkers & (checkers - 1)) == 0: # Not in double check
+            if checkers:
+                checkerSq = checkers.bit_length() - 1
+                checkMask = checkers | BETWEEN[kingSq][checkerSq]
+            else:
+                checkMask = FULL
+                if not capturesOnly:
+                    self.getCastleMoves(SQUARE120[kingSq], moves)
+            pins = self.getPinnedPieces(kingSq, allyColor, enemyColor, occupied)
+            targets = (enemies if capturesOnly else ~allies) & checkMask
+            self.getBitboardPawnMoves(allyColor, enemyColor, kingSq, occupied, checkMask, pins, moves, capturesOnly)
+            for piece, attacks in (('N', None), ('B', BISHOP_RAYS), ('R', ROOK_RAYS), ('Q', None)):
+                pieces = bitboards[allyColor + piece]
+                while pieces:
+                    bit = pieces & -pieces
+                    pieces ^= bit
+                    sq = bit.bit_length() - 1
+                    if piece == 'N':
+                        if sq in pins: # A pinned knight can never move
+                            continue
+                        pieceTargets = KNIGHT_ATTACKS[sq] & targets
+                    elif piece == 'Q':
+                        pieceTargets = (slidingAttacks(sq, occupied, ROOK_RAYS) | slidingAttacks(sq, occupied, BISHOP_RAYS)) & targets
+                    else:
+                        pieceTargets = slidingAttacks(sq, occupied, attacks) & targets
+                    if sq in pins:
+                        pieceTargets &= pins[sq]
+                    pieceMove = MOVED[allyColor + piece] | sq
+                    while pieceTargets:
+                        targetBit = pieceTargets & -pieceTargets
+                        pieceTargets ^= targetBit
+                        target = targetBit.bit_length() - 1
+                        if targetBit & enemies:
+                            moves.append(pieceMove | target << 6 | board[SQUARE120[target]] << CAPTURED_SHIFT)
+                        else:
+                            moves.append(pieceMove | target << 6)
+        return moves
+
+    def getBitboardPawnMoves(self, allyColor, enemyColor, kingSq, occupied, checkMask, pins, moves, capturesOnly=False):
+        board = self.board
+        enemies = self.occupancy[enemyColor]
+        if allyColor == 'w':
+            forward, startRow, backRow = -8, 6, 0
+        else:
+            forward, startRow, backRow = 8, 1, 7
+        epBit = 0
+        if self.enPassantPossible != ():
+            epBit = 1 << (self.enPassantPossible[0] * 8 + self.enPassantPossible[1])
+        pawns = self.bitboards[allyColor + 'P']
+        pawnMove = MOVED[allyColor + 'P']
+        while pawns:
+            bit = pawns & -pawns
+            pawns ^= bit
+            sq = bit.bit_length() - 1
+            allowed = checkMask & pins.get(sq, FULL)
+            r = sq // 8
+            pawnPromotion = r + forward // 8 == backRow
+            move = pawnMove | sq | (PROMOTION if pawnPromotion else 0)
+            oneStep = sq + forward
+            if not (occupied >> oneStep) & 1 and (pawnPromotion or not capturesOnly):
+                if (allowed >> oneStep) & 1:
+                    moves.append(move | oneStep << 6)
+                twoSteps = oneStep + forward
+                if r == startRow and not (occupied >> twoSteps) & 1 and (allowed >> twoSteps) & 1:
+                    moves.append(move | twoSteps << 6)
+            captures = PAWN_ATTACKS[allyColor][sq] & enemies & allowed
+            while captures:
+                targetBit = captures & -captures
+                captures ^= targetBit
+                target = targetBit.bit_length() - 1
+                moves.append(move | target << 6 | board[SQUARE120[target]] << CAPTURED_SHIFT)
+            if PAWN_ATTACKS[allyColor][sq] & epBit and self.isLegalBitboardEnPassant(sq, epBit, forward, enemyColor, kingSq, occupied):
+                moves.append(move | (epBit.bit_length() - 1) << 6 | EN_PASSANT | CAPTURED[enemyColor + 'P'])
+
+    # En passant removes two pieces from the same rank, so it is checked by playing it on the occupancy
+    def isLegalBitboardEnPassant(self, sq, epBit, forward, enemyColor, kingSq, occupied):
+        capturedBit = epBit << 8 if forward == -8 else epBit >> 8
+        occupied = (occupied ^ (1 << sq) ^ capturedBit) | epBit
+        self.bitboards[enemyColor + 'P'] ^= capturedBit
+        attacked = self.isAttacked(kingSq, enemyColor, occupied)
+        self.bitboards[enemyColor + 'P'] ^= capturedBit
+        return not attacked
@@ -1,9 +1,151 @@
 # Responsible for storing all information about current state of chess game and determining valid moves
+import random
 import numpy as np
 
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+pieceValue = {
+    'P': 1,  # Pawn
+    'R': 5,  # Rook
+    'N': 3,  # Knight
+    'B': 3,  # Bishop
+    'Q': 9,  # Queen
+    'K': 0   # King (not used in scoring)
+}
+
+knightScores = np.array([[1,1,1,1,1,1,1,1],
+                [1,2,2,2,2,2,2,1],
+                [1,2,3,3,3,3,2,1],
+                [1,2,3,4,4,3,2,1],
+                [1,2,3,4,4,3,2,1],
+                [1,2,3,3,3,3,2,1],
+                [1,2,2,2,2,2,2,1],
+                [1,1,1,1,1,1,1,1]])
+
+bishopScores = np.array([[4,3,2,1,1,2,3,4],
+                [3,4,3,2,2,3,4,3],
+                [2,3,4,3,3,4,3,2],
+                [1,2,3,4,4,3,2,1],
+                [1,2,3,4,4,3,2,1],
+                [2,3,4,3,3,4,3,2],
+                [3,4,3,2,2,3,4,3],
+                [4,3,2,1,1,2,3,4]])
+
+queenScores = np.array([[1,1,1,3,1,1,1,1],
+               [1,2,3,3,3,1,1,1],
+               [1,4,3,3,3,4,2,1],
+               [1,2,3,3,3,2,2,1],
+               [1,2,3,3,3,2,2,1],
+               [1,4,3,3,3,4,2,1],
+               [1,2,3,3,3,1,1,1],
+               [1,1,1,3,1,1,1,1]])
+
+rookScores = np.array([[4,3,4,4,4,4,3,4],
+              [4,4,4,4,4,4,4,4],
+              [1,1,2,3,3,2,1,1],
+              [1,2,3,4,4,3,2,1],
+              [1,2,3,4,4,3,2,1],
+              [1,1,2,3,3,2,1,1],
+              [4,4,4,4,4,4,4,4],
+              [4,3,4,4,4,4,3,4]])
+
+whitePawnScores = np.array([[8,8,8,8,8,8,8,8],
+                   [8,8,8,8,8,8,8,8],
+                   [5,6,6,7,7,6,6,5],
+                   [2,3,3,5,5,3,3,2],
+                   [1,2,3,4,4,3,2,1],
+                   [1,1,2,3,3,2,1,1],
+                   [1,1,1,0,0,1,1,1],
+                   [0,0,0,0,0,0,0,0]])
+
+blackPawnScores = np.array([[0,0,0,0,0,0,0,0],
+                   [1,1,1,0,0,1,1,1],
+                   [1,1,2,3,3,2,1,1],
+                   [1,2,3,4,4,3,2,1],
+                   [2,3,3,5,5,3,3,2],
+                   [5,6,6,7,7,6,6,5],
+                   [8,8,8,8,8,8,8,8],
+                   [8,8,8,8,8,8,8,8]])
+
+piecePositionScores = {'N': knightScores, 
+                       'B': bishopScores, 
+                       'Q': queenScores, 
+                       'R': rookScores, 
+                       'wP': whitePawnScores,
+                       'bP': blackPawnScores}
+
+# Value of every piece on every square in tenths of a pawn (material plus position), positive for white
+def pieceSquareTable(piece):
+    positionScores = piecePositionScores.get(piece, piecePositionScores.get(piece[1]))
+    sign = 1 if piece[0] == 'w' else -1
+    if positionScores is None: # King
+        return [sign * pieceValue[piece[1]] * 10] * 64
+    return [sign * (pieceValue[piece[1]] * 10 + int(positionScores[sq // 8][sq % 8])) for sq in range(64)]
+
+pieceSquareValues = {piece: pieceSquareTable(piece) for piece in ['wP', 'wR', 'wN', 'wB', 'wQ', 'wK', 'bP', 'bR', 'bN', 'bB', 'bQ', 'bK']}
+
+# Zobrist keys. The seed is fixed so a position hashes to the same key in every session
+zobristRandom = random.Random(0x5EED)
+zobristPieces = {piece: [zobristRandom.getrandbits(64) for sq in range(64)]
+                 for piece in ['wP', 'wR', 'wN', 'wB', 'wQ', 'wK', 'bP', 'bR', 'bN', 'bB', 'bQ', 'bK']}
+zobristCastling = [zobristRandom.getrandbits(64) for i in range(16)] # One per combination of castling rights
+zobristEnPassant = [zobristRandom.getrandbits(64) for col in range(8)] # One per en passant file
+zobristBlackToMove = zobristRandom.getrandbits(64)
+
+# Moves are generated and played as packed ints, Move objects are only built for the UI and notation.
+# bits 0-5 start square, 6-11 end square, 12-14 flags, 15-18 piece moved, 19-22 piece captured. Squares are row * 8 + col
+PIECE_NAMES = ['--', 'wP', 'wR', 'wN', 'wB', 'wQ', 'wK', 'bP', 'bR', 'bN', 'bB', 'bQ', 'bK']
+PIECE_CODES = {piece: code for code, piece in enumerate(PIECE_NAMES)}
+PAWN, ROOK, KNIGHT, BISHOP, QUEEN, KING = range(1, 7) # Codes of the white pieces, a black piece's code is BLACK higher
+BLACK = 6
+PROMOTION = 1 << 12
+EN_PASSANT = 1 << 13
+CASTLE = 1 << 14
+MOVED_SHIFT = 15
+CAPTURED_SHIFT = 19
+NULL_MOVE = 0 # Passing the turn, only played by the search. No real move is a8 to a8
+CASTLING_SQUARES = 1 << 0 | 1 << 4 | 1 << 7 | 1 << 56 | 1 << 60 | 1 << 63 # Only moves from or to a corner or king square change rights
+
+# The board is a 10x12 mailbox of piece codes. The 8x8 board sits inside a border of OFF_BOARD squares, two rows deep
+# above and below so knight jumps stay in the list, and steps or slides stop on the border without bounds checks
+EMPTY = 0
+OFF_BOARD = 13
+SQUARE120 = [(sq // 8 + 2) * 10 + sq % 8 + 1 for sq in range(64)] # Mailbox index of each row * 8 + col square
+SQUARE64 = [-1] * 120
+for _sq, _mailboxSq in enumerate(SQUARE120):
+    SQUARE64[_mailboxSq] = _sq
+ROOK_DIRECTIONS = (-10, -1, 10, 1)
+BISHOP_DIRECTIONS = (-11, -9, 9, 11)
+QUEEN_DIRECTIONS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+KNIGHT_STEPS = (-21, -19, -12, -8, 8, 12, 19, 21)
+TRACK_ATTACKS = False # Keep an AttackMap up to date on every move so attack queries are a table lookup instead of a scan
+
+# The evaluation and Zobrist tables indexed by piece code, an empty square scores and hashes to 0
+squareValuesByCode = [[0] * 64] + [pieceSquareValues[piece] for piece in PIECE_NAMES[1:]]
+zobristByCode = [[0] * 64] + [zobristPieces[piece] for piece in PIECE_NAMES[1:]]
+
+# Mailbox board from 8 rows of piece names
+def mailbox(rows):
+    board = [OFF_BOARD] * 120
+    for sq, mailboxSq in enumerate(SQUARE120):
+        board[mailboxSq] = PIECE_CODES[rows[sq // 8][sq % 8]]
+    return board
+
+# Same arguments as Move, for generators that only need the packed form
+def packMove(startSq, endSq, board, enPassant=False, pawnPromotion=False, isCastleMove=False):
+    start = startSq[0] * 8 + startSq[1]
+    end = endSq[0] * 8 + endSq[1]
+    pieceMoved = board[SQUARE120[start]]
+    if enPassant:
+        pieceCaptured = PAWN + BLACK if pieceMoved == PAWN else PAWN
+    else:
+        pieceCaptured = board[SQUARE120[end]]
+    return (start | end << 6 | pawnPromotion * PROMOTION | enPassant * EN_PASSANT |
+            isCastleMove * CASTLE | pieceMoved << MOVED_SHIFT | pieceCaptured << CAPTURED_SHIFT)
+
 class GameState():
     def __init__(self):
-        self.board=np.array([
+        self.board = mailbox([
             ["bR","bN","bB","bQ","bK","bB","bN","bR"],
             ["bP","bP","bP","bP","bP","bP","bP","bP"],
             ["--","--","--","--","--","--","--","--"],
@@ -15,516 +157,795 @@ class GameState():
             ])
         self.whiteToMove = True
         self.movesLog=[]
-        self.whiteKingLocation = (7, 4)
-        self.blackKingLocation = (0, 4)
+        self.whiteKingSquare = SQUARE120[60] # Mailbox squares
+        self.blackKingSquare = SQUARE120[4]
         self.inCheck = False
-        self.pins =[]
+        self.pins = {}
         self.checks = []
         self.enPassantPossible = ()
         self.enPassantPossibleLog = [self.enPassantPossible]
         self.currentCastlingRights = CastleRights(True, True, True, True) # White King Side, White Queen Side, Black King Side, Black Queen Side
         self.castleRightsLog = [CastleRights(self.currentCastlingRights.wKS, self.currentCastlingRights.wQS,
                                              self.currentCastlingRights.bKS, self.currentCastlingRights.bQS)]
+        self.zobristKey = self.computeZobristKey()
+        self.zobristLog = [self.zobristKey]
+        self.evaluation = self.computeEvaluation()
+        self.evaluationLog = [self.evaluation]
+        self.attackMap = AttackMap(self.board) if TRACK_ATTACKS else None
+        self.halfmoveClock = 0 # Plies since the last capture or pawn move, for the fifty move rule
+        self.halfmoveClockLog = [self.halfmoveClock]
+        self.fullmoveNumber = 1
+
+    # Sets up the position of a FEN string: board, side to move, castling rights, en passant square and the clocks
+    def loadFEN(self, fen):
+        fields = fen.split()
+        rows = []
+        for rank in fields[0].split('/'):
+            row = []
+            for char in rank:
+                if char.isdigit():
+                    row += ["--"] * int(char)
+                else:
+                    row.append(('w' if char.isupper() else 'b') + char.upper())
+            rows.append(row)
+        if len(rows) != 8 or any(len(row) != 8 for row in rows):
+            raise ValueError("Invalid FEN board: " + fields[0])
+        pieces = [piece for row in rows for piece in row]
+        if pieces.count('wK') != 1 or pieces.count('bK') != 1: # Move generation and check detection need both kings
+            raise ValueError("Invalid FEN board, each side needs exactly one king: " + fields[0])
+        self.board = mailbox(rows)
+        for sq in SQUARE120:
+            if self.board[sq] == KING:
+                self.whiteKingSquare = sq
+            elif self.board[sq] == KING + BLACK:
+                self.blackKingSquare = sq
+        self.whiteToMove = len(fields) < 2 or fields[1] == 'w'
+        castling = fields[2] if len(fields) > 2 else '-'
+        self.currentCastlingRights = CastleRights('K' in castling, 'Q' in castling, 'k' in castling, 'q' in castling)
+        self.castleRightsLog = [CastleRights('K' in castling, 'Q' in castling, 'k' in castling, 'q' in castling)]
+        if len(fields) > 3 and fields[3] != '-':
+            self.enPassantPossible = (Move.ranksToRows[fields[3][1]], Move.filesToCols[fields[3][0]])
+        else:
+            self.enPassantPossible = ()
+        self.enPassantPossibleLog = [self.enPassantPossible]
+        self.movesLog = []
+        self.inCheck = False
+        self.pins = {}
+        self.checks = []
+        self.checkMate = False
+        self.staleMate = False
+        self.zobristKey = self.computeZobristKey()
+        self.zobristLog = [self.zobristKey]
+        self.evaluation = self.computeEvaluation()
+        self.evaluationLog = [self.evaluation]
+        self.attackMap = AttackMap(self.board) if TRACK_ATTACKS else None
+        self.halfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+        self.halfmoveClockLog = [self.halfmoveClock]
+        self.fullmoveNumber = int(fields[5]) if len(fields) > 5 else 1
+
+    # FEN string of the position, the inverse of loadFEN
+    def getFEN(self):
+        rows = []
+        for r in range(8):
+            row = ''
+            empty = 0
+            for c in range(8):
+                piece = PIECE_NAMES[self.board[SQUARE120[r * 8 + c]]]
+                if piece == '--':
+                    empty += 1
+                    continue
+                if empty:
+                    row += str(empty)
+                    empty = 0
+                row += piece[1] if piece[0] == 'w' else piece[1].lower()
+            rows.append(row + (str(empty) if empty else ''))
+        rights = self.currentCastlingRights
+        castling = ('K' if rights.wKS else '') + ('Q' if rights.wQS else '') + ('k' if rights.bKS else '') + ('q' if rights.bQS else '')
+        if self.enPassantPossible != ():
+            enPassant = Move.colsToFiles[self.enPassantPossible[1]] + Move.rowsToRanks[self.enPassantPossible[0]]
+        else:
+            enPassant = '-'
+        return ' '.join(['/'.join(rows), 'w' if self.whiteToMove else 'b', castling or '-', enPassant, str(self.halfmoveClock),
+                         str(self.fullmoveNumber)])
+
+    # Material and position score in tenths of a pawn, positive is good for white. makeMove keeps evaluation up to date
+    def computeEvaluation(self):
+        evaluation = 0
+        for sq, mailboxSq in enumerate(SQUARE120):
+            evaluation += squareValuesByCode[self.board[mailboxSq]][sq]
+        return evaluation
+
+    # Full hash of the position. makeMove keeps zobristKey up to date incrementally, this is only needed to start one
+    def computeZobristKey(self):
+        key = 0
+        for sq, mailboxSq in enumerate(SQUARE120):
+            key ^= zobristByCode[self.board[mailboxSq]][sq]
+        key ^= zobristCastling[self.currentCastlingRights.index()]
+        if self.enPassantPossible != ():
+            key ^= zobristEnPassant[self.enPassantPossible[1]]
+        if not self.whiteToMove:
+            key ^= zobristBlackToMove
+        return key
 
-    
     def makeMove(self, move):
-        self.board[move.startRow][move.startCol] = "--"
-        self.board[move.endRow][move.endCol] = move.pieceMoved
+        if move.__class__ is not int: # Move objects from the UI
+            move = move.packed
+        self.updateZobristKey(move)
+        self.updateEvaluation(move)
+        board = self.board
+        startSq = SQUARE120[move & 63]
+        endSq = SQUARE120[move >> 6 & 63]
+        pieceMoved = move >> MOVED_SHIFT & 15
+        if self.attackMap is not None:
+            changedSquares, affected = self.attackMap.beginMove(board, move)
+        board[startSq] = EMPTY
+        board[endSq] = pieceMoved
         self.movesLog.append(move)
         self.whiteToMove = not self.whiteToMove # switch turns
         # Update king's position
-        if move.pieceMoved == "wK":
-            self.whiteKingLocation = (move.endRow, move.endCol)
-        elif move.pieceMoved == "bK":
-            self.blackKingLocation = (move.endRow, move.endCol)
+        if pieceMoved == KING:
+            self.whiteKingSquare = endSq
+        elif pieceMoved == KING + BLACK:
+            self.blackKingSquare = endSq
         # If pawn moves twice, next move can be en passant
-        if move.pieceMoved[1] == 'P' and abs(move.startRow - move.endRow) == 2:
-            self.enPassantPossible = ((move.endRow + move.startRow)//2, move.endCol)
+        if (pieceMoved == PAWN or pieceMoved == PAWN + BLACK) and abs(startSq - endSq) == 20:
+            self.enPassantPossible = (((move >> 3 & 7) + (move >> 9 & 7)) // 2, move >> 6 & 7)
         else:
             self.enPassantPossible = ()
         # If en passant is captured, remove the pawn
-        if move.enPassant:
-            self.board[move.startRow][move.endCol] = "--"
+        if move & EN_PASSANT:
+            board[SQUARE120[move & 56 | move >> 6 & 7]] = EMPTY
         # If pawn promotes, replace it with the promoted piece
-        if move.pawnPromotion:
+        if move & PROMOTION:
             #promotedPiece = input("Enter the piece to promote to (Q, R, B, N): ")
-            promotedPiece = 'Q'
-            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + promotedPiece
+            board[endSq] = pieceMoved + QUEEN - PAWN
         # castle move
-        if move.isCastleMove:
-            if move.endCol - move.startCol == 2: # Kingside castle
-                self.board[move.endRow][move.endCol - 1] = self.board[move.endRow][move.endCol + 1]
-                self.board[move.endRow][move.endCol + 1] = "--"
+        if move & CASTLE:
+            if endSq - startSq == 2: # Kingside castle
+                board[endSq - 1] = board[endSq + 1]
+                board[endSq + 1] = EMPTY
             else: # Queenside castle
-                self.board[move.endRow][move.endCol + 1] = self.board[move.endRow][move.endCol - 2]
-                self.board[move.endRow][move.endCol - 2] = "--"
+                board[endSq + 1] = board[endSq - 2]
+                board[endSq - 2] = EMPTY
+        if self.attackMap is not None:
+            self.attackMap.endMove(board, changedSquares, affected)
 
         self.enPassantPossibleLog.append(self.enPassantPossible)
         # Update castling rights
         self.updateCastlingRights(move)
         self.castleRightsLog.append(CastleRights(self.currentCastlingRights.wKS, self.currentCastlingRights.wQS,
                                              self.currentCastlingRights.bKS, self.currentCastlingRights.bQS))
+        # En passant and castling keys can only be swapped once the new state is known
+        key = self.zobristKey
+        if self.enPassantPossible != ():
+            key ^= zobristEnPassant[self.enPassantPossible[1]]
+        key ^= zobristCastling[self.currentCastlingRights.index()]
+        self.zobristKey = key
+        self.zobristLog.append(key)
+        self.evaluationLog.append(self.evaluation)
+        if move >> CAPTURED_SHIFT or pieceMoved == PAWN or pieceMoved == PAWN + BLACK:
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
+        self.halfmoveClockLog.append(self.halfmoveClock)
+        if self.whiteToMove: # Black just moved
+            self.fullmoveNumber += 1
+
+    # Only the squares touched by the move change the score
+    def updateEvaluation(self, move):
+        pieceMoved = move >> MOVED_SHIFT & 15
+        values = squareValuesByCode[pieceMoved]
+        startSq = move & 63
+        endSq = move >> 6 & 63
+        if move & PROMOTION:
+            evaluation = self.evaluation - values[startSq] + squareValuesByCode[pieceMoved + QUEEN - PAWN][endSq]
+        else:
+            evaluation = self.evaluation - values[startSq] + values[endSq]
+        captured = squareValuesByCode[move >> CAPTURED_SHIFT & 15]
+        if move & EN_PASSANT:
+            evaluation -= captured[startSq & 56 | endSq & 7]
+        else:
+            evaluation -= captured[endSq]
+        if move & CASTLE:
+            rookValues = squareValuesByCode[pieceMoved + ROOK - KING]
+            if endSq - startSq == 2: # Kingside castle
+                evaluation += rookValues[endSq - 1] - rookValues[endSq + 1]
+            else: # Queenside castle
+                evaluation += rookValues[endSq + 1] - rookValues[endSq - 2]
+        self.evaluation = evaluation
 
+    # Removes the old side to move, en passant and castling keys and applies the pieces moved by this move
+    def updateZobristKey(self, move):
+        key = self.zobristKey ^ zobristBlackToMove
+        if self.enPassantPossible != ():
+            key ^= zobristEnPassant[self.enPassantPossible[1]]
+        key ^= zobristCastling[self.currentCastlingRights.index()]
+        pieceMoved = move >> MOVED_SHIFT & 15
+        startSq = move & 63
+        endSq = move >> 6 & 63
+        key ^= zobristByCode[pieceMoved][startSq]
+        if move & PROMOTION:
+            key ^= zobristByCode[pieceMoved + QUEEN - PAWN][endSq]
+        else:
+            key ^= zobristByCode[pieceMoved][endSq]
+        captured = zobristByCode[move >> CAPTURED_SHIFT & 15]
+        if move & EN_PASSANT:
+            key ^= captured[startSq & 56 | endSq & 7]
+        else:
+            key ^= captured[endSq]
+        if move & CASTLE:
+            rook = zobristByCode[pieceMoved + ROOK - KING]
+            if endSq - startSq == 2: # Kingside castle
+                key ^= rook[endSq + 1] ^ rook[endSq - 1]
+            else: # Queenside castle
+                key ^= rook[endSq - 2] ^ rook[endSq + 1]
+        self.zobristKey = key
 
 
+    # Hands the turn to the other side without moving, for null move pruning. undoMove takes it back like any other move
+    def makeNullMove(self):
+        key = self.zobristKey ^ zobristBlackToMove
+        if self.enPassantPossible != ():
+            key ^= zobristEnPassant[self.enPassantPossible[1]]
+        self.enPassantPossible = ()
+        self.whiteToMove = not self.whiteToMove
+        self.movesLog.append(NULL_MOVE)
+        self.enPassantPossibleLog.append(self.enPassantPossible)
+        self.castleRightsLog.append(CastleRights(self.currentCastlingRights.wKS, self.currentCastlingRights.wQS,
+                                             self.currentCastlingRights.bKS, self.currentCastlingRights.bQS))
+        self.zobristKey = key
+        self.zobristLog.append(key)
+        self.evaluationLog.append(self.evaluation)
+        self.halfmoveClockLog.append(self.halfmoveClock)
+        if self.attackMap is not None:
+            self.attackMap.passMove()
+
     def undoMove(self):
         if len(self.movesLog)!=0 :
             move = self.movesLog.pop()
-            self.board[move.startRow][move.startCol] = move.pieceMoved
-            self.board[move.endRow][move.endCol] = move.pieceCaptured
+            if self.attackMap is not None:
+                self.attackMap.undoMove()
+            if move == NULL_MOVE:
+                self.whiteToMove = not self.whiteToMove
+                self.enPassantPossibleLog.pop()
+                self.enPassantPossible = self.enPassantPossibleLog[-1]
+                self.castleRightsLog.pop()
+                self.zobristLog.pop()
+                self.zobristKey = self.zobristLog[-1]
+                self.evaluationLog.pop()
+                self.halfmoveClockLog.pop()
+                self.checkMate = False
+                self.staleMate = False
+                return
+            board = self.board
+            startSq = SQUARE120[move & 63]
+            endSq = SQUARE120[move >> 6 & 63]
+            pieceMoved = move >> MOVED_SHIFT & 15
+            pieceCaptured = move >> CAPTURED_SHIFT & 15
+            board[startSq] = pieceMoved
+            board[endSq] = pieceCaptured
             self.whiteToMove = not self.whiteToMove # switch turns back
             # Update king's position
-            if move.pieceMoved == "wK":
-                self.whiteKingLocation = (move.startRow, move.startCol)
-            elif move.pieceMoved == "bK":
-                self.blackKingLocation = (move.startRow, move.startCol)
+            if pieceMoved == KING:
+                self.whiteKingSquare = startSq
+            elif pieceMoved == KING + BLACK:
+                self.blackKingSquare = startSq
             # Undo en passant
-            if move.enPassant:
-                self.board[move.endRow][move.endCol] = "--"
-                self.board[move.startRow][move.endCol] = move.pieceCaptured
+            if move & EN_PASSANT:
+                board[endSq] = EMPTY
+                board[SQUARE120[move & 56 | move >> 6 & 7]] = pieceCaptured
             self.enPassantPossibleLog.pop()
             self.enPassantPossible = self.enPassantPossibleLog[-1]
             # Undo castling rights
             self.castleRightsLog.pop()
-            self.currentCastlingRights = self.castleRightsLog[-1]
+            # Copy so updateCastlingRights on the next move cannot modify the log entry
+            lastRights = self.castleRightsLog[-1]
+            self.currentCastlingRights = CastleRights(lastRights.wKS, lastRights.wQS, lastRights.bKS, lastRights.bQS)
+            self.zobristLog.pop()
+            self.zobristKey = self.zobristLog[-1]
+            self.evaluationLog.pop()
+            self.evaluation = self.evaluationLog[-1]
+            self.halfmoveClockLog.pop()
+            self.halfmoveClock = self.halfmoveClockLog[-1]
+            if not self.whiteToMove:
+                self.fullmoveNumber -= 1
             ##############################################################################
             # Undo castle move
-            if move.isCastleMove:
-                if move.endCol - move.startCol == 2: # Kingside castle
-                    self.board[move.endRow][move.endCol + 1] = self.board[move.endRow][move.endCol - 1]
-                    self.board[move.endRow][move.endCol - 1] = "--"
+            if move & CASTLE:
+                if endSq - startSq == 2: # Kingside castle
+                    board[endSq + 1] = board[endSq - 1]
+                    board[endSq - 1] = EMPTY
                 else: # Queenside castle
-                    self.board[move.endRow][move.endCol - 2] = self.board[move.endRow][move.endCol + 1]
-                    self.board[move.endRow][move.endCol + 1] = "--"
+                    board[endSq - 2] = board[endSq + 1]
+                    board[endSq + 1] = EMPTY
 
             
             self.checkMate = False
             self.staleMate = False
 
     def updateCastlingRights(self, move):
-        if move.pieceMoved == "wK":
+        if not (CASTLING_SQUARES >> (move & 63) & 1 or CASTLING_SQUARES >> (move >> 6 & 63) & 1):
+            return
+        pieceMoved = move >> MOVED_SHIFT & 15
+        startSq = move & 63
+        if pieceMoved == KING:
             self.currentCastlingRights.wKS = False
             self.currentCastlingRights.wQS = False
-        elif move.pieceMoved == "bK":
+        elif pieceMoved == KING + BLACK:
             self.currentCastlingRights.bKS = False
             self.currentCastlingRights.bQS = False
-        elif move.pieceMoved == "wR":
-            if move.startRow == 7 and move.startCol == 0:
+        elif pieceMoved == ROOK:
+            if startSq == 56:
                 self.currentCastlingRights.wQS = False
-            elif move.startRow == 7 and move.startCol == 7:
+            elif startSq == 63:
                 self.currentCastlingRights.wKS = False
-        elif move.pieceMoved == "bR":
-            if move.startRow == 0 and move.startCol == 0:
+        elif pieceMoved == ROOK + BLACK:
+            if startSq == 0:
                 self.currentCastlingRights.bQS = False
-            elif move.startRow == 0 and move.startCol == 7:
+            elif startSq == 7:
                 self.currentCastlingRights.bKS = False
 
         # if rook is captured
-        if move.pieceCaptured == 'wR':
-            if move.endRow == 7:
-                if move.endCol == 0:
-                    self.currentCastlingRights.wQS = False
-                elif move.endCol == 7:
-                    self.currentCastlingRights.wKS = False
-        if move.pieceCaptured == 'bR':
-            if move.endRow == 0:
-                if move.endCol == 0:
-                    self.currentCastlingRights.bQS = False
-                elif move.endCol == 7:
-                    self.currentCastlingRights.bKS = False
+        pieceCaptured = move >> CAPTURED_SHIFT & 15
+        endSq = move >> 6 & 63
+        if pieceCaptured == ROOK:
+            if endSq == 56:
+                self.currentCastlingRights.wQS = False
+            elif endSq == 63:
+                self.currentCastlingRights.wKS = False
+        elif pieceCaptured == ROOK + BLACK:
+            if endSq == 0:
+                self.currentCastlingRights.bQS = False
+            elif endSq == 7:
+                self.currentCastlingRights.bKS = False
 
     #All moves with check
     def getValidMoves(self):
-        moves = []
+        return [Move.fromPacked(move) for move in self.generateMoves()]
+
+    # Legal moves as packed ints, also sets checkMate and staleMate
+    def generateMoves(self):
         self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
-        if self.whiteToMove:
-            kingRow = self.whiteKingLocation[0]
-            kingCol = self.whiteKingLocation[1]
-            self.getCastleMoves(kingRow, kingCol, moves, 'w')
-        else:
-            kingRow = self.blackKingLocation[0]
-            kingCol = self.blackKingLocation[1]
-            self.getCastleMoves(kingRow, kingCol, moves, 'b')
+        kingSq = self.whiteKingSquare if self.whiteToMove else self.blackKingSquare
         if self.inCheck:
             if len(self.checks) == 1:
                 moves = self.getAllPossibleMoves()
-                check = self.checks[0]
-                checkRow = check[0]
-                checkCol = check[1]
-                pieceChecking = self.board[checkRow][checkCol]
-                validSquares = []
-                if pieceChecking[1] == 'N':
-                    validSquares = [(checkRow, checkCol)]
-                else:
-                    for i in range(1, 8):
-                        validSquare = (kingRow + check[2] * i, kingCol + check[3] * i)
-                        validSquares.append(validSquare)
-                        if validSquare[0] == checkRow and validSquare[1] == checkCol:
-                            break
-                for i in range(len(moves)-1, -1, -1):
-                    if moves[i].pieceMoved[1] != 'K':
-                        if not (moves[i].endRow, moves[i].endCol) in validSquares:
-                            moves.remove(moves[i])
+                checkSq, d = self.checks[0]
+                if self.board[checkSq] == KNIGHT or self.board[checkSq] == KNIGHT + BLACK:
+                    validSquares = {SQUARE64[checkSq]}
+                else: # Capture the checking piece or block between it and the king
+                    validSquares = {SQUARE64[sq] for sq in range(kingSq + d, checkSq + d, d)}
+                king = self.board[kingSq]
+                checker = SQUARE64[checkSq]
+                # En passant removes a checking pawn without moving onto its square
+                moves = [move for move in moves if move >> MOVED_SHIFT & 15 == king or move >> 6 & 63 in validSquares or
+                         move & EN_PASSANT and move & 56 | move >> 6 & 7 == checker]
             else: # Double check
-                self.getKingMoves(kingRow, kingCol, moves)
+                moves = []
+                self.getKingMoves(kingSq, moves)
         else: # Not in check
             moves = self.getAllPossibleMoves()
         if len(moves) == 0: # Checkmate or Stalemate
-            if self.isInCheck():
+            if self.inCheck:
                 self.checkMate = True
-                print("Checkmate")
             else:
                 self.staleMate = True
-                print("Stalemate")
         else: # For undo moves
             self.checkMate = False
             self.staleMate = False
         return moves
-    
+
+    # Captures and promotions only, or every evasion when in check
+    def getCaptureMoves(self):
+        return [Move.fromPacked(move) for move in self.generateCaptures()]
+
+    def generateCaptures(self):
+        self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
+        if self.inCheck:
+            return self.generateMoves()
+        self.checkMate = False
+        self.staleMate = False
+        return self.getAllPossibleMoves(capturesOnly=True)
+
+    # Whether the side to move has any legal move, stopping at the first piece that has one. Sets checkMate and staleMate
+    # like generateMoves, so leaves can tell checkmate and stalemate apart without generating every move
+    def hasLegalMove(self):
+        self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
+        if self.inCheck:
+            return len(self.generateMoves()) > 0
+        board = self.board
+        ally = 0 if self.whiteToMove else BLACK
+        moves = []
+        generators = (None, self.getPawnMoves, self.getRookMoves, self.getKnightMoves, self.getBishopMoves, self.getQueenMoves)
+        for sq in SQUARE120:
+            pieceType = board[sq] - ally
+            if 0 < pieceType < KING:
+                generators[pieceType](sq, moves)
+                if moves:
+                    break
+        else:
+            self.getKingMoves(self.whiteKingSquare if self.whiteToMove else self.blackKingSquare, moves)
+        self.checkMate = False
+        self.staleMate = not moves
+        return len(moves) > 0
+
+    # Legal moves one stage at a time: the hash move, captures and promotions, the killers, then quiet moves.
+    # Later stages are only generated if the search asks for them, so a cutoff on an early move skips the rest.
+    # The order functions sort the moves of a stage, checkMate and staleMate stay False until every stage came up empty
+    def generateStagedMoves(self, hashMove=0, killers=(), orderCaptures=None, orderQuiets=None):
+        self.inCheck = self.isInCheck()
+        self.checkMate = False
+        self.staleMate = False
+        return self.stagedMoves(self.inCheck, hashMove, killers, orderCaptures, orderQuiets)
+
+    # inCheck is passed in because nothing here runs before the first move is asked for. By then the search may have
+    # played and undone moves, e.g. a null move, and self.inCheck holds whatever the positions below left in it
+    def stagedMoves(self, inCheck, hashMove, killers, orderCaptures, orderQuiets):
+        # Each stage generates from the board as it is when the stage starts
+        if hashMove and self.isLegalMove(hashMove):
+            yield hashMove
+        else:
+            hashMove = 0
+        if inCheck: # Evasions are few, they are generated at once and split into the stages
+            moves = self.generateMoves()
+            captures = [move for move in moves if not isQuiet(move)]
+            quiets = [move for move in moves if isQuiet(move)]
+        else:
+            captures = self.generateCaptures()
+            quiets = None
+        if orderCaptures is not None and len(captures) > 1:
+            captures = orderCaptures(captures)
+        for move in captures:
+            if move != hashMove:
+                yield move
+        tried = [hashMove]
+        for killer in killers:
+            if killer and killer not in tried and isQuiet(killer) and (killer in quiets if inCheck else self.isLegalMove(killer)):
+                tried.append(killer)
+                yield killer
+        if quiets is None:
+            quiets = [move for move in self.generateMoves() if isQuiet(move)]
+        if orderQuiets is not None and len(quiets) > 1:
+            quiets = orderQuiets(quiets)
+        for move in quiets:
+            if move not in tried:
+                yield move
+
+    # Whether a packed move, from the transposition table or another node, is legal here. Only the moving piece's moves are generated
+    def isLegalMove(self, move):
+        sq = SQUARE120[move & 63]
+        piece = self.board[sq]
+        ally = 0 if self.whiteToMove else BLACK
+        if piece != move >> MOVED_SHIFT & 15 or not 0 < piece - ally <= 6:
+            return False
+        self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
+        if self.inCheck:
+            return move in self.generateMoves()
+        moves = []
+        generators = (None, self.getPawnMoves, self.getRookMoves, self.getKnightMoves, self.getBishopMoves, self.getQueenMoves,
+                      self.getKingMoves)
+        generators[piece - ally](sq, moves)
+        return move in moves
+
+    # Pins map the square of a pinned piece to the direction from the king to it, checks are (square, direction) pairs
     def checkForPinsAndChecks(self):
-        pins = []
+        pins = {}
         checks = []
-        inCheck = False
+        board = self.board
         if self.whiteToMove:
-            enemyColor = 'b'
-            allyColor = 'w'
-            startRow = self.whiteKingLocation[0]
-            startCol = self.whiteKingLocation[1]
+            kingSq, ally, enemy = self.whiteKingSquare, 0, BLACK
+            pawnDirections = (-11, -9) # Where an enemy pawn attacks the king from
         else:
-            enemyColor = 'w'
-            allyColor = 'b'
-            startRow = self.blackKingLocation[0]
-            startCol = self.blackKingLocation[1]
-        
-        directions = [(-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)]
-        
-        for j in range(len(directions)):
-            d = directions[j]
-            possiblePins = ()
-            for i in range(1, 8):
-                endRow = startRow + d[0] * i
-                endCol = startCol + d[1] * i
-                if 0 <= endRow < 8 and 0 <= endCol < 8:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] == allyColor and endPiece[1] != 'K':
-                        if possiblePins == ():
-                            possiblePins = (endRow, endCol, d[0], d[1])
+            kingSq, ally, enemy = self.blackKingSquare, BLACK, 0
+            pawnDirections = (9, 11)
+        allyKing = KING + ally
+        for directions, slider in ((ROOK_DIRECTIONS, ROOK + enemy), (BISHOP_DIRECTIONS, BISHOP + enemy)):
+            for d in directions:
+                possiblePin = None
+                sq = kingSq + d
+                piece = board[sq]
+                while piece != OFF_BOARD:
+                    if piece != EMPTY and piece != allyKing:
+                        if ally < piece <= ally + 6:
+                            if possiblePin is not None:
+                                break
+                            possiblePin = sq
                         else:
-                            break
-                    elif endPiece[0] == enemyColor:
-                        type = endPiece[1]
-                        # 5 possible checks
-                        # Orthogonally away from king and piece is Rook
-                        # Diagonally away from king and piece is Bishop
-                        # 1 square away from king and piece is pawn
-                        # Any direction and piece is King
-                        if(0<=j<=3 and type=='R') or (4<=j<=7 and type=='B') or \
-                            (i==1 and type=='P' and((enemyColor=='w' and 6<=j<=7) or \
-                            (enemyColor=='b' and 4<=j<=5))) or (type=='Q') or \
-                            (i==1 and type=='K'):
-                                if possiblePins == ():
-                                    inCheck = True
-                                    checks.append((endRow, endCol, d[0], d[1]))
-                                    break
+                            # Sliders along their lines, and a pawn or king next to the king
+                            if piece == slider or piece == QUEEN + enemy or (sq == kingSq + d and
+                                    (piece == KING + enemy or piece == PAWN + enemy and d in pawnDirections)):
+                                if possiblePin is None:
+                                    checks.append((sq, d))
                                 else:
-                                    pins.append(possiblePins)
-                                    break
-                        else:
+                                    pins[possiblePin] = d
                             break
-                else:
-                    break
-        knightMoves = [(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)]
-        for m in knightMoves:
-            endRow = startRow + m[0]
-            endCol = startCol + m[1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] == enemyColor and endPiece[1] == 'N':
-                    inCheck = True
-                    checks.append((endRow, endCol, m[0], m[1]))
-        return inCheck, pins, checks
+                    sq += d
+                    piece = board[sq]
+        for d in KNIGHT_STEPS:
+            if board[kingSq + d] == KNIGHT + enemy:
+                checks.append((kingSq + d, d))
+        return len(checks) > 0, pins, checks
+
     def isInCheck(self):
-        if self.whiteToMove:
-            return self.isSquareUnderAttack(self.whiteKingLocation[0], self.whiteKingLocation[1])
-        else:
-            return self.isSquareUnderAttack(self.blackKingLocation[0], self.blackKingLocation[1])      
+        return self.attacked(self.whiteKingSquare if self.whiteToMove else self.blackKingSquare, self.whiteToMove)
+
     def isSquareUnderAttack(self, r, c):
-        self.whiteToMove = not self.whiteToMove # Switch to opponent's turn
-        opponentMoves = self.getAllPossibleMoves()
-        self.whiteToMove = not self.whiteToMove # Switch back to current player's turn
-        for move in opponentMoves:
-            if move.endRow == r and move.endCol == c: # Square is under attack
-                return True
-        return False
-    
-    def squareUnderAttack(self, r, c, ally_color):
-        enemy_color = 'w' if ally_color == 'b' else 'b'
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
-        for j in range(len(directions)):
-            d = directions[j]
-            for i in range(1, 8):
-                end_row = r + d[0] * i
-                end_col = c + d[1] * i
-                if 0 <= end_row < 8 and 0 <= end_col < 8:
-                    end_piece = self.board[end_row][end_col]
-                    if end_piece[0] == ally_color and end_piece[1] != 'K':
-                        break
-                    elif end_piece[0] == enemy_color:
-                        type = end_piece[1]
-                        # 5 possible checks
-                        # Orthogonally away from king and piece is Rook
-                        # Diagonally away from king and piece is Bishop
-                        # 1 square away from king and piece is pawn
-                        # Any direction and piece is King
-                        if(0<=j<=3 and type=='R') or (4<=j<=7 and type=='B') or \
-                            (i==1 and type=='P' and((enemy_color=='w' and 6<=j<=7) or \
-                            (enemy_color=='b' and 4<=j<=5))) or (type=='Q') or \
-                            (i==1 and type=='K'):
-                            return True
-                        else:
-                            break
-                else:
-                    break
-        knightMoves = [(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)]
-        for m in knightMoves:
-            endRow = r + m[0]
-            endCol = c + m[1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] == enemy_color and endPiece[1] == 'N':
+        return self.attacked(SQUARE120[r * 8 + c], self.whiteToMove)
+
+    # Attack queries on the position as played, answered by the attack map when one is kept
+    def attacked(self, sq, white):
+        if self.attackMap is not None:
+            return self.attackMap.counts[1 if white else 0][sq] > 0
+        return self.squareUnderAttack(sq, white)
+
+    # Whether the enemies of white (or black) attack a mailbox square. The king of the defending side doesn't block,
+    # so a king can't step back along the ray it is checked on
+    def squareUnderAttack(self, sq, white):
+        board = self.board
+        if white:
+            ally, enemy, pawnDirections = 0, BLACK, (-11, -9)
+        else:
+            ally, enemy, pawnDirections = BLACK, 0, (9, 11)
+        allyKing = KING + ally
+        for directions, slider in ((ROOK_DIRECTIONS, ROOK + enemy), (BISHOP_DIRECTIONS, BISHOP + enemy)):
+            for d in directions:
+                target = sq + d
+                piece = board[target]
+                while piece == EMPTY or piece == allyKing:
+                    target += d
+                    piece = board[target]
+                if piece == slider or piece == QUEEN + enemy:
                     return True
+                if target == sq + d and (piece == KING + enemy or piece == PAWN + enemy and d in pawnDirections):
+                    return True
+        for d in KNIGHT_STEPS:
+            if board[sq + d] == KNIGHT + enemy:
+                return True
         return False
 
     # All moves without check
-    def getAllPossibleMoves(self):
+    def getAllPossibleMoves(self, capturesOnly=False):
         moves=[]
-        for r in range(8):
-            for c in range(8):
-                piece = self.board[r][c]
-                if piece != "--":
-                    if (piece[0] == 'w' and self.whiteToMove) or (piece[0] == 'b' and not self.whiteToMove):
-                        if(piece[1] == 'P'):
-                            self.getPawnMoves(r, c, moves)
-                        elif(piece[1] == 'R'):
-                            self.getRookMoves(r, c, moves)
-                        elif(piece[1] == 'N'):
-                            self.getKnightMoves(r, c, moves)
-                        elif(piece[1] == 'B'):
-                            self.getBishopMoves(r, c, moves)
-                        elif(piece[1] == 'Q'):
-                            self.getQueenMoves(r, c, moves)
-                        elif(piece[1] == 'K'):
-                            self.getKingMoves(r, c, moves)
+        board = self.board
+        ally = 0 if self.whiteToMove else BLACK
+        for sq in SQUARE120:
+            pieceType = board[sq] - ally
+            if 0 < pieceType <= 6:
+                if pieceType == PAWN:
+                    self.getPawnMoves(sq, moves, capturesOnly)
+                elif pieceType == KNIGHT:
+                    self.getKnightMoves(sq, moves, capturesOnly)
+                elif pieceType == BISHOP:
+                    self.getBishopMoves(sq, moves, capturesOnly)
+                elif pieceType == ROOK:
+                    self.getRookMoves(sq, moves, capturesOnly)
+                elif pieceType == QUEEN:
+                    self.getQueenMoves(sq, moves, capturesOnly)
+                else:
+                    self.getKingMoves(sq, moves, capturesOnly)
         return moves 
-                          
-    def getPawnMoves(self, r, c, moves):
-        piecePinned = False
-        pinDirection = ()
-        for i in range(len(self.pins)-1,-1,-1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                pinDirection = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
 
+    # Generators take mailbox squares and append packed moves
+    def getPawnMoves(self, sq, moves, capturesOnly=False):
+        board = self.board
+        pinDirection = self.pins.get(sq)
         if self.whiteToMove:
-            moveAmount = -1
-            startRow = 6
-            backRow = 0
-            enemyColor = 'b'
-            kingRow, kingCol = self.whiteKingLocation
+            forward, startRank, backRank, enemy = -10, 8, 2, BLACK
         else:
-            moveAmount = 1
-            startRow = 1
-            backRow = 7
-            enemyColor = 'w'
-            kingRow, kingCol = self.blackKingLocation
-        pawnPromotion = False
-
-        if self.board[r + moveAmount][c] == "--":
-            if not piecePinned or pinDirection == (moveAmount, 0):
-                if r + moveAmount == backRow:
-                    pawnPromotion = True
-                moves.append(Move((r, c), (r + moveAmount, c), self.board, pawnPromotion=pawnPromotion))
-                if r == startRow and self.board[r + 2 * moveAmount][c] == "--":
-                    moves.append(Move((r, c), (r + 2 * moveAmount, c), self.board))
-        if c - 1 >= 0:
-            if not piecePinned or pinDirection == (moveAmount, -1):
-                if self.board[r + moveAmount][c - 1][0] == enemyColor:
-                    if r + moveAmount == backRow:
-                        pawnPromotion = True
-                    moves.append(Move((r, c), (r + moveAmount, c - 1), self.board, pawnPromotion=pawnPromotion))
-                if (r + moveAmount, c-1) == self.enPassantPossible:
-                    attackingPiece = blockingPiece = False
-                    if kingRow == r:
-                        if kingCol < c:
-                            insideRange = range(kingCol + 1, c - 1)
-                            outsideRange = range(c + 1, 8)
-                        else:
-                            insideRange = range(kingCol - 1, c - 1)
-                            outsideRange = range(c - 2, -1, -1)
-                        for i in insideRange:
-                            if self.board[r][i] != "--":
-                                blockingPiece = True
-                        for i in outsideRange:
-                            if self.board[r][i][0] == enemyColor and (self.board[r][i][1]=='R' or self.board[r][i][1]=='Q'):
-                                attackingPiece = True
-                            elif self.board[r][i] != "--":
-                                blockingPiece = True
-                    if not attackingPiece or blockingPiece:
-                        moves.append(Move((r, c), (r + moveAmount, c - 1), self.board, enPassant=True))
-
-        if c + 1 <= 7:
-            if not piecePinned or pinDirection == (moveAmount, 1):
-                if self.board[r + moveAmount][c + 1][0] == enemyColor:
-                    if r + moveAmount == backRow:
-                        pawnPromotion = True
-                    moves.append(Move((r, c), (r + moveAmount, c + 1), self.board, pawnPromotion=pawnPromotion))
-                if (r + moveAmount, c+1) == self.enPassantPossible:
-                    attackingPiece = blockingPiece = False
-                    if kingRow == r:
-                        if kingCol < c:
-                            insideRange = range(kingCol + 1, c)
-                            outsideRange = range(c + 2, 8)
-                        else:
-                            insideRange = range(kingCol - 1, c + 1)
-                            outsideRange = range(c - 1, -1, -1)
-                        for i in insideRange:
-                            if self.board[r][i] != "--":
-                                blockingPiece = True
-                        for i in outsideRange:
-                            if self.board[r][i][0] == enemyColor and (self.board[r][i][1]=='R' or self.board[r][i][1]=='Q'):
-                                attackingPiece = True
-                            elif self.board[r][i] != "--":
-                                blockingPiece = True
-                    if not attackingPiece or blockingPiece:
-                        moves.append(Move((r, c), (r + moveAmount, c + 1), self.board, enPassant=True))
-
-    def getRookMoves(self, r, c, moves):
-        piecePinned = False
-        pinDirection = ()
-        for i in range(len(self.pins)-1,-1,-1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                pinDirection = (self.pins[i][2], self.pins[i][3])
-                if (self.board[r][c][1]!= 'Q'): # Cant remove queen from pin on rook moves, only remove for bishop moves
-                    self.pins.remove(self.pins[i])
-                break
-        directions = [(-1, 0), (0, -1), (1, 0), (0, 1)]
-        enemy_color = 'b' if self.whiteToMove else 'w'
-        for d in directions:
-            for i in range(1, 8):
-                end_row = r + d[0]*i
-                end_col = c + d[1]*i
-                if 0 <= end_row < 8 and 0 <= end_col < 8:
-                    if not piecePinned or pinDirection == d or pinDirection == (-d[0],-d[1]):
-                        end_piece = self.board[end_row][end_col]
-                        if end_piece == "--":
-                            moves.append(Move((r, c), (end_row, end_col), self.board))
-                        elif end_piece[0] == enemy_color:
-                            moves.append(Move((r, c), (end_row, end_col), self.board))
-                            break
-                        else: # Friendly piece encountered
-                            break
-                else: # Off the board
-                    break
-    def getKnightMoves(self, r, c, moves):
-        piecePinned = False
-        for i in range(len(self.pins)-1,-1,-1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                self.pins.remove(self.pins[i])
-                break
-        knight_moves = [(-2, -1), (-2, 1), (-1, -2), (-1, 2),(1, -2), (1, 2), (2, -1), (2, 1)]
-        ally_color = 'w' if self.whiteToMove else 'b'
-        for m in knight_moves:
-            end_row = r + m[0]
-            end_col = c + m[1]
-            if 0 <= end_row < 8 and 0 <= end_col < 8:
-                if not piecePinned:
-                    end_piece = self.board[end_row][end_col]
-                    if end_piece == "--" or end_piece[0] != ally_color:
-                        moves.append(Move((r, c), (end_row, end_col), self.board))
-    def getBishopMoves(self, r, c, moves):
-        piecePinned = False
-        pinDirection = ()
-        for i in range(len(self.pins)-1,-1,-1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piecePinned = True
-                pinDirection = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
-        directions = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
-        enemy_color = 'b' if self.whiteToMove else 'w'
+            forward, startRank, backRank, enemy = 10, 3, 9, 0
+        move = SQUARE64[sq] | board[sq] << MOVED_SHIFT
+        target = sq + forward
+        if target // 10 == backRank:
+            move |= PROMOTION
+        if board[target] == EMPTY and (not capturesOnly or move & PROMOTION):
+            if pinDirection is None or pinDirection == forward or pinDirection == -forward:
+                moves.append(move | SQUARE64[target] << 6)
+                if sq // 10 == startRank and board[target + forward] == EMPTY:
+                    moves.append(move | SQUARE64[target + forward] << 6)
+        for d in (forward - 1, forward + 1):
+            if pinDirection is not None and pinDirection != d and pinDirection != -d:
+                continue
+            target = sq + d
+            piece = board[target]
+            if enemy < piece <= enemy + 6:
+                moves.append(move | SQUARE64[target] << 6 | piece << CAPTURED_SHIFT)
+            elif piece == EMPTY and self.enPassantPossible != () and \
+                    SQUARE64[target] == self.enPassantPossible[0] * 8 + self.enPassantPossible[1]:
+                if self.isLegalEnPassant(sq, target, enemy):
+                    moves.append(move | SQUARE64[target] << 6 | EN_PASSANT | (PAWN + enemy) << CAPTURED_SHIFT)
+
+    # En passant removes two pieces from the king's rank or a diagonal at once, so it is played on the board to test it
+    def isLegalEnPassant(self, sq, target, enemy):
+        board = self.board
+        capturedSq = sq - sq % 10 + target % 10
+        pawn = board[sq]
+        board[sq] = EMPTY
+        board[capturedSq] = EMPTY
+        board[target] = pawn
+        attacked = self.squareUnderAttack(self.whiteKingSquare if self.whiteToMove else self.blackKingSquare, self.whiteToMove)
+        board[target] = EMPTY
+        board[capturedSq] = PAWN + enemy
+        board[sq] = pawn
+        return not attacked
+
+    def getRookMoves(self, sq, moves, capturesOnly=False):
+        self.getSlidingMoves(sq, ROOK_DIRECTIONS, moves, capturesOnly)
+
+    def getBishopMoves(self, sq, moves, capturesOnly=False):
+        self.getSlidingMoves(sq, BISHOP_DIRECTIONS, moves, capturesOnly)
+
+    def getQueenMoves(self, sq, moves, capturesOnly=False):
+        self.getSlidingMoves(sq, QUEEN_DIRECTIONS, moves, capturesOnly)
+
+    def getSlidingMoves(self, sq, directions, moves, capturesOnly=False):
+        board = self.board
+        pinDirection = self.pins.get(sq)
+        enemy = BLACK if self.whiteToMove else 0
+        move = SQUARE64[sq] | board[sq] << MOVED_SHIFT
         for d in directions:
-            for i in range(1, 8):
-                end_row = r + d[0]*i
-                end_col = c + d[1]*i
-                if 0 <= end_row < 8 and 0 <= end_col < 8:
-                    if not piecePinned or pinDirection == d or pinDirection == (-d[0],-d[1]):
-                        end_piece = self.board[end_row][end_col]
-                        if end_piece == "--":
-                            moves.append(Move((r, c), (end_row, end_col), self.board))
-                        elif end_piece[0] == enemy_color:
-                            moves.append(Move((r, c), (end_row, end_col), self.board))
-                            break
-                        else: # Friendly piece encountered
-                            break
-                else: # Off the board
-                    break
-    def getQueenMoves(self, r, c, moves):   
-        self.getRookMoves(r, c, moves)
-        self.getBishopMoves(r, c, moves)
-    def getKingMoves(self, r, c, moves):
-        rowMoves = (-1,-1,-1,0,0,1,1,1)
-        colMoves = (-1,0,1,-1,1,-1,0,1)
-        ally_color = 'w' if self.whiteToMove else 'b'
-        for i in range(8):
-            end_row = r + rowMoves[i]
-            end_col = c + colMoves[i]
-            if 0 <= end_row < 8 and 0 <= end_col < 8:
-                end_piece = self.board[end_row][end_col]
-                if end_piece[0]!=ally_color:
-                    if ally_color == 'w':
-                        self.whiteKingLocation = (end_row, end_col)
-                    else:
-                        self.blackKingLocation = (end_row, end_col)
-                    inChecks, pins, checks = self.checkForPinsAndChecks()
-                    if not inChecks:
-                        moves.append(Move((r, c), (end_row, end_col), self.board))
-                    if ally_color == 'w':
-                        self.whiteKingLocation = (r, c)
-                    else:
-                        self.blackKingLocation = (r, c)
-        self.getCastleMoves(r, c, moves, ally_color)
-
-    def getCastleMoves(self, r, c, moves, ally_color):
-        inCheck = self.squareUnderAttack(r, c, ally_color)
-        if inCheck:
+            if pinDirection is not None and pinDirection != d and pinDirection != -d:
+                continue
+            target = sq + d
+            piece = board[target]
+            while piece == EMPTY:
+                if not capturesOnly:
+                    moves.append(move | SQUARE64[target] << 6)
+                target += d
+                piece = board[target]
+            if enemy < piece <= enemy + 6: # Stops on a friendly piece or the border otherwise
+                moves.append(move | SQUARE64[target] << 6 | piece << CAPTURED_SHIFT)
+
+    def getKnightMoves(self, sq, moves, capturesOnly=False):
+        if sq in self.pins: # A pinned knight can never move
+            return
+        board = self.board
+        enemy = BLACK if self.whiteToMove else 0
+        move = SQUARE64[sq] | board[sq] << MOVED_SHIFT
+        for d in KNIGHT_STEPS:
+            piece = board[sq + d]
+            if enemy < piece <= enemy + 6:
+                moves.append(move | SQUARE64[sq + d] << 6 | piece << CAPTURED_SHIFT)
+            elif piece == EMPTY and not capturesOnly:
+                moves.append(move | SQUARE64[sq + d] << 6)
+
+    def getKingMoves(self, sq, moves, capturesOnly=False):
+        board = self.board
+        enemy = BLACK if self.whiteToMove else 0
+        move = SQUARE64[sq] | board[sq] << MOVED_SHIFT
+        for d in QUEEN_DIRECTIONS:
+            piece = board[sq + d]
+            if enemy < piece <= enemy + 6 or (piece == EMPTY and not capturesOnly):
+                if not self.attacked(sq + d, self.whiteToMove):
+                    moves.append(move | SQUARE64[sq + d] << 6 | (piece << CAPTURED_SHIFT if piece != EMPTY else 0))
+        if not capturesOnly:
+            self.getCastleMoves(sq, moves)
+
+    def getCastleMoves(self, sq, moves):
+        if self.attacked(sq, self.whiteToMove):
             return
         if (self.whiteToMove and self.currentCastlingRights.wKS) or (not self.whiteToMove and self.currentCastlingRights.bKS):
-            self.getKingsideCastleMoves(r, c, moves, ally_color)
+            self.getKingsideCastleMoves(sq, moves)
         if (self.whiteToMove and self.currentCastlingRights.wQS) or (not self.whiteToMove and self.currentCastlingRights.bQS):
-            self.getQueensideCastleMoves(r, c, moves, ally_color)
+            self.getQueensideCastleMoves(sq, moves)
         
-    def getKingsideCastleMoves(self, r, c, moves, ally_color):
-        if self.board[r][c+1] == "--" and self.board[r][c+2] == "--":
-            if not self.squareUnderAttack(r, c+1, ally_color) and not self.squareUnderAttack(r, c+2, ally_color):
-                moves.append(Move((r, c), (r, c + 2), self.board, isCastleMove=True))
+    def getKingsideCastleMoves(self, sq, moves):
+        if self.board[sq + 1] == EMPTY and self.board[sq + 2] == EMPTY:
+            if not self.attacked(sq + 1, self.whiteToMove) and not self.attacked(sq + 2, self.whiteToMove):
+                moves.append(SQUARE64[sq] | SQUARE64[sq + 2] << 6 | CASTLE | self.board[sq] << MOVED_SHIFT)
+
+    def getQueensideCastleMoves(self, sq, moves):
+        if self.board[sq - 1] == EMPTY and self.board[sq - 2] == EMPTY and self.board[sq - 3] == EMPTY:
+            if not self.attacked(sq - 1, self.whiteToMove) and not self.attacked(sq - 2, self.whiteToMove):
+                moves.append(SQUARE64[sq] | SQUARE64[sq - 2] << 6 | CASTLE | self.board[sq] << MOVED_SHIFT)
+
+# Neither a capture nor a promotion
+def isQuiet(move):
+    return not move & PROMOTION and not move >> CAPTURED_SHIFT
+
+# Number of white and black pieces attacking each mailbox square, counting defended pieces and the border.
+# Sliders see through the king of the other side, like squareUnderAttack, so a king can't step back along a checking ray.
+# A move only changes the attacks of the pieces on the squares it touches and of the sliders that see those squares
+class AttackMap():
+    def __init__(self, board):
+        self.counts = [[0] * 120, [0] * 120] # White attackers, black attackers
+        self.log = []
+        for sq in SQUARE120:
+            if board[sq] != EMPTY:
+                self.addAttacks(board, sq, 1)
+
+    def addAttacks(self, board, sq, delta):
+        piece = board[sq]
+        white = piece <= KING
+        counts = self.counts[0 if white else 1]
+        pieceType = piece if white else piece - BLACK
+        if pieceType == PAWN:
+            for d in ((-11, -9) if white else (9, 11)):
+                counts[sq + d] += delta
+        elif pieceType == KNIGHT:
+            for d in KNIGHT_STEPS:
+                counts[sq + d] += delta
+        elif pieceType == KING:
+            for d in QUEEN_DIRECTIONS:
+                counts[sq + d] += delta
+        else:
+            directions = ROOK_DIRECTIONS if pieceType == ROOK else BISHOP_DIRECTIONS if pieceType == BISHOP else QUEEN_DIRECTIONS
+            transparent = KING + BLACK if white else KING
+            for d in directions:
+                target = sq + d
+                counts[target] += delta
+                while board[target] == EMPTY or board[target] == transparent:
+                    target += d
+                    counts[target] += delta
+
+    # Squares of the sliders whose attacks reach sq, looking back along each line from it
+    def addSlidersSeeing(self, board, sq, found):
+        for directions, slider in ((ROOK_DIRECTIONS, ROOK), (BISHOP_DIRECTIONS, BISHOP)):
+            for d in directions:
+                target = sq + d
+                piece = board[target]
+                while piece == EMPTY:
+                    target += d
+                    piece = board[target]
+                if piece == KING or piece == KING + BLACK: # Only sliders of the other side see through it
+                    enemy = BLACK if piece == KING else 0
+                    target += d
+                    piece = board[target]
+                    while piece == EMPTY:
+                        target += d
+                        piece = board[target]
+                    if piece == slider + enemy or piece == QUEEN + enemy:
+                        found.add(target)
+                elif piece == slider or piece == QUEEN or piece == slider + BLACK or piece == QUEEN + BLACK:
+                    found.add(target)
 
-    def getQueensideCastleMoves(self, r, c, moves, ally_color):
-        if self.board[r][c-1] == "--" and self.board[r][c-2] == "--" and self.board[r][c-3] == "--":
-            if not self.squareUnderAttack(r, c-1, ally_color) and not self.squareUnderAttack(r, c-2, ally_color):
-                moves.append(Move((r, c), (r, c - 2), self.board, isCastleMove=True))
+    # Takes away the attacks that the move can change, before the board is updated. endMove adds them back afterwards
+    def beginMove(self, board, move):
+        self.log.append(self.counts)
+        self.counts = [self.counts[0][:], self.counts[1][:]]
+        startSq = SQUARE120[move & 63]
+        endSq = SQUARE120[move >> 6 & 63]
+        changedSquares = [startSq, endSq]
+        if move & EN_PASSANT:
+            changedSquares.append(SQUARE120[move & 56 | move >> 6 & 7])
+        if move & CASTLE:
+            changedSquares += [endSq + 1, endSq - 1] if endSq - startSq == 2 else [endSq - 2, endSq + 1]
+        affected = set()
+        for sq in changedSquares:
+            if board[sq] != EMPTY:
+                affected.add(sq)
+            self.addSlidersSeeing(board, sq, affected)
+        for sq in affected:
+            self.addAttacks(board, sq, -1)
+        return changedSquares, affected
+
+    def endMove(self, board, changedSquares, affected):
+        affected.update(changedSquares)
+        for sq in affected:
+            if board[sq] != EMPTY:
+                self.addAttacks(board, sq, 1)
+
+    # The counts are copied before every change, so a null move can log them as they are
+    def passMove(self):
+        self.log.append(self.counts)
+
+    def undoMove(self):
+        self.counts = self.log.pop()
 
 class CastleRights():
+    __slots__ = ('wKS', 'wQS', 'bKS', 'bQS')
+
     def __init__(self, wKS, wQS, bKS, bQS):
         self.wKS = wKS  # White King Side
         self.wQS = wQS  # White Queen Side
         self.bKS = bKS  # Black King Side
         self.bQS = bQS  # Black Queen Side
 
+    def index(self):
+        return self.wKS | self.wQS << 1 | self.bKS << 2 | self.bQS << 3
+
 class Move():
+    __slots__ = ('startRow', 'startCol', 'endRow', 'endCol', 'pieceMoved', 'pieceCaptured', 'enPassant', 'pawnPromotion',
+                 'isCastleMove', 'isCapture', 'moveID', 'packed')
     # key : value
     ranksToRows = {"1": 7, "2": 6, "3": 5, "4": 4, "5": 3, "6": 2, "7": 1, "8": 0}
     rowsToRanks = {v: k for k, v in ranksToRows.items()}
@@ -533,19 +954,28 @@ class Move():
 
 
     def __init__(self, startSq, endSq, board, enPassant=False, pawnPromotion=False, isCastleMove=False):
-        self.startRow = startSq[0]
-        self.startCol = startSq[1]
-        self.endRow = endSq[0]
-        self.endCol = endSq[1]
-        self.pieceMoved = board[self.startRow][self.startCol]
-        self.pieceCaptured = board[self.endRow][self.endCol]
-        self.enPassant = enPassant
-        self.pawnPromotion = pawnPromotion
-        if enPassant:
-            self.pieceCaptured = "bP" if self.pieceMoved == "wP" else "wP"
-        self.isCastleMove = isCastleMove
+        self.unpack(packMove(startSq, endSq, board, enPassant, pawnPromotion, isCastleMove))
+
+    # Builds the Move a packed int stands for, everything it needs is in the int
+    @classmethod
+    def fromPacked(cls, packed):
+        move = cls.__new__(cls)
+        move.unpack(packed)
+        return move
+
+    def unpack(self, packed):
+        self.packed = packed
+        self.startRow = packed >> 3 & 7
+        self.startCol = packed & 7
+        self.endRow = packed >> 9 & 7
+        self.endCol = packed >> 6 & 7
+        self.pieceMoved = PIECE_NAMES[packed >> MOVED_SHIFT & 15]
+        self.pieceCaptured = PIECE_NAMES[packed >> CAPTURED_SHIFT & 15]
+        self.enPassant = bool(packed & EN_PASSANT)
+        self.pawnPromotion = bool(packed & PROMOTION)
+        self.isCastleMove = bool(packed & CASTLE)
         self.isCapture = self.pieceCaptured != "--"
-        self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
+        self.moveID = packed & 0xFFF # Start and end squares, all a click on the board can tell apart
 
     #def getChessNotation(self): # Very basic chess notation. Can be improved later
     #    return self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
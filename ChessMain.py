@@ -1,8 +1,11 @@
 # Responsible for handling user input and diplay current gameState object
 
 
+import queue
+from multiprocessing import Process, Queue, Event
 import pygame as p
 import ChessEngine
+import BitboardEngine
 import MoveFinder
 
 BOARD_WIDTH = 768
@@ -13,6 +16,27 @@ DIMENSION = 8 # 8x8
 SQUARE_SIZE = BOARD_HEIGHT // DIMENSION
 MAX_FPS = 30
 IMAGES = {}
+USE_BITBOARDS = False # The mailbox board generates moves faster than bitboards do in pure Python
+
+def newGameState():
+    if USE_BITBOARDS:
+        return BitboardEngine.BitboardGameState()
+    return ChessEngine.GameState()
+
+# The engine searches in a background process so the window keeps rendering and handling input
+def startSearch(gs, validMoves):
+    returnQueue = Queue()
+    stopEvent = Event()
+    moveFinderProcess = Process(target=MoveFinder.findBestMoveProcess, args=(gs, validMoves, returnQueue, stopEvent))
+    moveFinderProcess.start()
+    return moveFinderProcess, returnQueue, stopEvent
+
+# A stale search stops within a few nodes, its result is never read. Joining it keeps finished processes from piling up
+def cancelSearch(search):
+    if search is not None:
+        search[2].set()
+        search[0].join()
+    return None
 
 # Initialize global dictionary of Images. It will load only once hence saving memory
 def loadImages():
@@ -26,7 +50,7 @@ def main():
     clock = p.time.Clock()
     screen.fill(p.Color("white"))
     moveLogFont = p.font.SysFont("Arial", 18, False, False)
-    gs = ChessEngine.GameState()
+    gs = newGameState()
     moveMade = False
     animate = False
     validMoves = gs.getValidMoves()
@@ -37,10 +61,12 @@ def main():
     gameOver = False
     playerOne = False  # True if human playing white, False if AI playing white
     playerTwo = False  # True if human playing black, False if AI playing black
+    search = None # (process, queue, stop event) of the AI search in progress
     while running:
         humanTurn = (gs.whiteToMove and playerOne) or (not gs.whiteToMove and playerTwo)
         for e in p.event.get():
             if e.type == p.QUIT:
+                search = cancelSearch(search)
                 running = False
             elif e.type == p.MOUSEBUTTONDOWN:
                 if not gameOver and humanTurn:
@@ -67,12 +93,14 @@ def main():
                             playerClicks = [sqSelected]
             elif e.type == p.KEYDOWN:
                 if e.key == p.K_z: # Undo the last move
+                    search = cancelSearch(search)
                     gs.undoMove()
                     moveMade = True
                     animate = False
                     gameOver = False
                 if e.key == p.K_r: # Reset the game
-                    gs = ChessEngine.GameState()
+                    search = cancelSearch(search)
+                    gs = newGameState()
                     validMoves = gs.getValidMoves()
                     sqSelected = ()
                     playerClicks = []
@@ -80,16 +108,35 @@ def main():
                     animate = False
                     gameOver = False
         # AI move logic
-        if not gameOver and not humanTurn:
-            AI_move = MoveFinder.findBestMove(gs, validMoves)
-            if AI_move is None:
-                AI_move = MoveFinder.findRandomMove(validMoves)
-            gs.makeMove(AI_move)
-            moveMade = True
-            animate = True
+        if running and not gameOver and not humanTurn and not moveMade:
+            if search is None:
+                search = startSearch(gs, validMoves)
+            else:
+                try:
+                    moveID = search[1].get_nowait()
+                except queue.Empty:
+                    moveID = None
+                    if not search[0].is_alive():
+                        # The move may have been put just before the process exited, look once more before giving up on it
+                        try:
+                            moveID = search[1].get(timeout=0.1)
+                        except queue.Empty: # Search process died without an answer
+                            moveID = -1
+                if moveID is not None:
+                    search[0].join()
+                    search = None
+                    AI_move = None
+                    for move in validMoves:
+                        if move.moveID == moveID:
+                            AI_move = move
+                    if AI_move is None:
+                        AI_move = MoveFinder.findRandomMove(validMoves)
+                    gs.makeMove(AI_move)
+                    moveMade = True
+                    animate = True
         if(moveMade):
             if animate:
-                animateMove(gs.movesLog[-1], screen, gs.board, clock)
+                animateMove(ChessEngine.Move.fromPacked(gs.movesLog[-1]), screen, gs.board, clock)
             validMoves = gs.getValidMoves()
             moveMade = False
         drawGameState(screen, gs, validMoves, sqSelected, moveLogFont)
@@ -108,7 +155,8 @@ def main():
 def highlightSquares(screen, gs, validMoves, sqSelected):
     if sqSelected != ():
         r, c = sqSelected
-        if gs.board[r][c][0] == ('w' if gs.whiteToMove else 'b'):  # Highlight only if the selected square has a piece of the current player
+        ally = 0 if gs.whiteToMove else ChessEngine.BLACK
+        if 0 < gs.board[ChessEngine.SQUARE120[r * 8 + c]] - ally <= 6:  # Highlight only if the selected square has a piece of the current player
             s = p.Surface((SQUARE_SIZE, SQUARE_SIZE))
             s.set_alpha(100)  # Set transparency
             s.fill(p.Color("#baca44"))
@@ -136,9 +184,9 @@ def drawBoard(screen):
 def drawPieces(screen, board):
     for r in range(DIMENSION):
         for c in range(DIMENSION):
-            piece = board[r][c]
-            if piece != "--":
-                screen.blit(IMAGES[piece], p.Rect(c*SQUARE_SIZE, r*SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
+            piece = board[ChessEngine.SQUARE120[r * 8 + c]]
+            if piece != ChessEngine.EMPTY: # The board holds piece codes, images are keyed by name
+                screen.blit(IMAGES[ChessEngine.PIECE_NAMES[piece]], p.Rect(c*SQUARE_SIZE, r*SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
 
 def animateMove(move, screen, board, clock):
     global colors
@@ -182,7 +230,7 @@ def drawText(screen, text):
 def drawMoveLog(screen, gs, font):
     moveLogRect = p.Rect(BOARD_WIDTH, 0, MOVE_LOG_PANEL_WIDTH, MOVE_LOG_PANEL_HEIGHT)
     p.draw.rect(screen, p.Color("black"), moveLogRect)
-    moveLog = gs.movesLog
+    moveLog = [ChessEngine.Move.fromPacked(move) for move in gs.movesLog]
     moveTexts = []
     for i in range(0,len(moveLog), 2):
         moveString = str(i//2 + 1) + "- " + moveLog[i].getChessNotation() + " "
@@ -0,0 +1,131 @@
+# Runs EPD test suites: each position is searched by findBestMove in a pool of worker processes and counts as solved
+# when the move played is one of its bm moves and none of its am moves. Time to solve is the CPU time the search took to settle on it
+# Usage: python EPD.py suite.epd [more.epd ...] [--movetime 5] [--nodes 100000] [--depth 6] [--workers 4] [--output report.json]
+
+import argparse
+import json
+import multiprocessing
+import shlex
+import sys
+import time
+import ChessEngine
+import MoveFinder
+from PGN import moveFromSAN
+
+# EPD line: the first four FEN fields, then operations such as bm Nf3 Qd5; am Qxb2; id "WAC.001";
+def parseEPD(line):
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        raise ValueError("Invalid EPD: " + line)
+    operations = {}
+    for operation in (fields[4] if len(fields) > 4 else '').split(';'):
+        tokens = shlex.split(operation)
+        if tokens:
+            operations[tokens[0]] = tokens[1:]
+    clocks = [operations.get('hmvc', ['0'])[0], operations.get('fmvn', ['1'])[0]]
+    return ' '.join(fields[:4] + clocks), operations
+
+def loadSuites(paths):
+    positions = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    positions.append(line)
+    return positions
+
+workerLimits = None
+
+def initWorker(limits):
+    global workerLimits
+    MoveFinder.initPoolWorker() # Suites test the search, not the book or earlier results
+    workerLimits = limits
+
+def solvePosition(task):
+    index, line = task
+    try:
+        fen, operations = parseEPD(line)
+        gs = ChessEngine.GameState()
+        gs.loadFEN(fen)
+    except (ValueError, KeyError, IndexError) as error:
+        return {'index': index, 'error': str(error)}
+    positionId = ' '.join(operations.get('id', [str(index + 1)]))
+    validMoves = gs.getValidMoves()
+    bestMoves = [move for move in (moveFromSAN(san, validMoves) for san in operations.get('bm', [])) if move is not None]
+    avoidMoves = [move for move in (moveFromSAN(san, validMoves) for san in operations.get('am', [])) if move is not None]
+    if not bestMoves and not avoidMoves: # e.g. only under-promotions, which the engine never plays
+        return {'index': index, 'id': positionId, 'error': "no bm or am move the engine can play"}
+
+    def isSolution(move):
+        return (not bestMoves or move in bestMoves) and move not in avoidMoves
+
+    # CPU seconds and whether the best move was a solution after each finished depth. CPU time, not wall time,
+    # so results don't depend on how many workers share the machine
+    depthMoves = []
+    def onProgress(stats):
+        depthMoves.append((time.process_time() - cpuStart, bool(stats.pv) and isSolution(ChessEngine.Move.fromPacked(stats.pv[0]))))
+
+    MoveFinder.transpositionTable.clear() # Every position starts from an empty table, so results don't depend on the order
+    cpuStart = time.process_time()
+    move, stats = MoveFinder.findBestMoveWithStats(gs, validMoves, *workerLimits, onProgress=onProgress)
+    cpuSeconds = time.process_time() - cpuStart
+    solved = move is not None and isSolution(move)
+    timeToSolve = None
+    if solved: # From the first depth after which the search never left a solution
+        for seconds, depthSolved in depthMoves:
+            if not depthSolved:
+                timeToSolve = None
+            elif timeToSolve is None:
+                timeToSolve = seconds
+        if timeToSolve is None: # Played from the tablebases without a search
+            timeToSolve = cpuSeconds
+    return {'index': index, 'id': positionId, 'solved': solved, 'move': move.getChessNotation() if move is not None else None,
+            'bm': operations.get('bm', []), 'am': operations.get('am', []),
+            'timeToSolve': round(timeToSolve, 3) if timeToSolve is not None else None, 'cpuSeconds': round(cpuSeconds, 3),
+            'depth': stats.depth if stats is not None else None, 'nodes': stats.nodes if stats is not None else None}
+
+def runSuite(positions, limits, workers, progress=None):
+    results = []
+    startTime = time.time()
+    with multiprocessing.Pool(workers, initializer=initWorker, initargs=(limits,)) as pool:
+        for result in pool.imap_unordered(solvePosition, list(enumerate(positions))):
+            results.append(result)
+            if progress is not None:
+                progress(result)
+    results.sort(key=lambda result: result['index'])
+    scored = [result for result in results if 'error' not in result]
+    solved = sum(result['solved'] for result in scored)
+    cpuSeconds = sum(result['cpuSeconds'] for result in scored)
+    return {'positions': len(positions), 'scored': len(scored), 'solved': solved,
+            'solveRate': round(solved / len(scored), 4) if scored else None,
+            'cpuSeconds': round(cpuSeconds, 2), 'solvedPerCpuSecond': round(solved / cpuSeconds, 4) if cpuSeconds > 0 else None,
+            'seconds': round(time.time() - startTime, 2), 'results': results}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Solve EPD test suites with bm/am operations")
+    parser.add_argument('suites', nargs='+', help="EPD files")
+    parser.add_argument('--movetime', type=float, help="Seconds per position")
+    parser.add_argument('--nodes', type=int, help="Nodes per position")
+    parser.add_argument('--depth', type=int, help="Depth per position, MoveFinder.DEPTH when no limit is given")
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--output', help="Write the JSON report to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    limits = MoveFinder.searchLimits(args.depth, args.movetime, args.nodes)
+
+    def progress(result):
+        status = 'error' if 'error' in result else 'solved' if result['solved'] else 'failed'
+        sys.stderr.write(str(result.get('id', result['index'] + 1)) + ": " + status + "\n")
+
+    report = runSuite(loadSuites(args.suites), limits, args.workers, progress)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,98 +1,489 @@
 # Find moves for AI
 
+import atexit
+import multiprocessing
+import os
+import queue
 import random
+import time
+from multiprocessing import shared_memory
 import numpy as np
+import TranspositionTable
+import OpeningBook
+import SearchCache
+import Tablebase
+from ChessEngine import pieceValue, knightScores, bishopScores, queenScores, rookScores, whitePawnScores, blackPawnScores, piecePositionScores, pieceSquareValues
+from ChessEngine import Move, PIECE_NAMES, PIECE_CODES, PROMOTION, EN_PASSANT, CASTLE, MOVED_SHIFT, CAPTURED_SHIFT, SQUARE120, PAWN, KING, BLACK, NULL_MOVE
 
-pieceValue = {
-    'P': 1,  # Pawn
-    'R': 5,  # Rook
-    'N': 3,  # Knight
-    'B': 3,  # Bishop
-    'Q': 9,  # Queen
-    'K': 0   # King (not used in scoring)
-}
 CHECKMATE = 1000
 STALEMATE = 0
-DEPTH = 4
-
-knightScores = np.array([[1,1,1,1,1,1,1,1],
-                [1,2,2,2,2,2,2,1],
-                [1,2,3,3,3,3,2,1],
-                [1,2,3,4,4,3,2,1],
-                [1,2,3,4,4,3,2,1],
-                [1,2,3,3,3,3,2,1],
-                [1,2,2,2,2,2,2,1],
-                [1,1,1,1,1,1,1,1]])
-
-bishopScores = np.array([[4,3,2,1,1,2,3,4],
-                [3,4,3,2,2,3,4,3],
-                [2,3,4,3,3,4,3,2],
-                [1,2,3,4,4,3,2,1],
-                [1,2,3,4,4,3,2,1],
-                [2,3,4,3,3,4,3,2],
-                [3,4,3,2,2,3,4,3],
-                [4,3,2,1,1,2,3,4]])
-
-queenScores = np.array([[1,1,1,3,1,1,1,1],
-               [1,2,3,3,3,1,1,1],
-               [1,4,3,3,3,4,2,1],
-               [1,2,3,3,3,2,2,1],
-               [1,2,3,3,3,2,2,1],
-               [1,4,3,3,3,4,2,1],
-               [1,2,3,3,3,1,1,1],
-               [1,1,1,3,1,1,1,1]])
-
-rookScores = np.array([[4,3,4,4,4,4,3,4],
-              [4,4,4,4,4,4,4,4],
-              [1,1,2,3,3,2,1,1],
-              [1,2,3,4,4,3,2,1],
-              [1,2,3,4,4,3,2,1],
-              [1,1,2,3,3,2,1,1],
-              [4,4,4,4,4,4,4,4],
-              [4,3,4,4,4,4,3,4]])
-
-whitePawnScores = np.array([[8,8,8,8,8,8,8,8],
-                   [8,8,8,8,8,8,8,8],
-                   [5,6,6,7,7,6,6,5],
-                   [2,3,3,5,5,3,3,2],
-                   [1,2,3,4,4,3,2,1],
-                   [1,1,2,3,3,2,1,1],
-                   [1,1,1,0,0,1,1,1],
-                   [0,0,0,0,0,0,0,0]])
-
-blackPawnScores = np.array([[0,0,0,0,0,0,0,0],
-                   [1,1,1,0,0,1,1,1],
-                   [1,1,2,3,3,2,1,1],
-                   [1,2,3,4,4,3,2,1],
-                   [2,3,3,5,5,3,3,2],
-                   [5,6,6,7,7,6,6,5],
-                   [8,8,8,8,8,8,8,8],
-                   [8,8,8,8,8,8,8,8]])
-
-piecePositionScores = {'N': knightScores, 
-                       'B': bishopScores, 
-                       'Q': queenScores, 
-                       'R': rookScores, 
-                       'wP': whitePawnScores,
-                       'bP': blackPawnScores}
+DEPTH = 3 # Deepest iteration of the search, quiescence resolves captures beyond it
+TIME_LIMIT = None # Seconds per move, None to always finish DEPTH
+NODE_LIMIT = None # Nodes per move, None for no limit
+MAX_SEARCH_DEPTH = 64 # Depth of searches bounded only by time, nodes or a stop signal
+QUIESCENCE = True # Search captures past the horizon instead of scoring the leaf directly
+DELTA_MARGIN = 2 # Captures that can't bring the score within this many pawns of alpha are skipped
+NULL_MOVE_PRUNING = True # Cut nodes where passing the turn still scores at least beta
+NULL_MOVE_REDUCTION = 2 # Plies taken off the null move search on top of the move passed
+LATE_MOVE_REDUCTIONS = True # Search quiet moves ordered late one ply shallower, and again at full depth if they beat alpha
+LMR_MIN_DEPTH = 3
+LMR_MIN_MOVES = 3 # Moves searched at full depth at each node before reductions start
+NULL_WINDOW = 0.05 # Narrower than the 0.1 pawn steps of the evaluation, so a search with it only tells above from below
+HASH_SIZE_MB = 16
+HELPER_POLL = 0.5 # Seconds between checks that the helper processes of a parallel search are still alive
+WORKERS = 1 # Processes searching each move, more than one shares the transposition table between them (Lazy SMP)
+BOOK_PATH = "opening_book.bin" # Built with OpeningBook.py, no book is used if the file doesn't exist
+BOOK_RANDOM = False # Pick book moves in proportion to how often they were played instead of always the most played
+TABLEBASE_PATH = "tablebases" # Built with Tablebase.py, endgames are searched normally if the directory doesn't exist
+SEARCH_CACHE_PATH = None # SQLite file that keeps search results between sessions, positions searched before at least as deep aren't searched again
+SEARCH_CACHE_ENTRIES = 1000000 # Least recently used results are evicted past this many
+SEARCH_CACHE_AGE = None # Seconds a result is kept without being used, None to keep it until it is evicted
+SEARCH_STATS = True # Fill a SearchStats for each search: counters, principal variation and timing of every depth. Off, only the nodes the limits need are counted
+TABLEBASE_WIN = 500 # Score of a won tablebase position, less one per ply to mate so shorter mates are preferred
+
+transpositionTable = TranspositionTable.TranspositionTable(HASH_SIZE_MB)
+sharedMemory = None # Block behind transpositionTable once a parallel search has run
+stopSignal = None # Event that cancels the running search, e.g. when the UI takes the position back
+openingBook = None
+bookLoaded = False
+tablebases = None
+tablebasesLoaded = False
+searchCache = None
+searchCacheLoaded = False
+
+# Boards as integer arrays for batch evaluation. Row i of pieceSquareArray is the value of piece i on every square
+PIECE_INDICES = PIECE_CODES
+pieceSquareArray = np.zeros((13, 64), dtype=np.int32)
+for piece, index in PIECE_INDICES.items():
+    if piece != "--":
+        pieceSquareArray[index] = pieceSquareValues[piece]
+codeValues = [0] + [pieceValue[piece[1]] for piece in PIECE_NAMES[1:]] # pieceValue by the piece codes of packed moves
+
+# Move ordering. Ordering scores of every combination of flags, piece moved and piece captured (bits 12-22 of a packed move):
+# captures by MVV-LVA, the most valuable victim first and the least valuable attacker among equal victims, and promotions
+CAPTURE_SCORE = 1 << 18
+KILLER_SCORE = 1 << 17
+MAX_HISTORY = 1 << 16
+MOVE_SCORES = [0] * (1 << 11)
+for _index in range(1 << 11):
+    _moved, _captured = _index >> 3 & 15, _index >> 7 & 15
+    if _moved >= len(codeValues) or _captured >= len(codeValues): # Not piece codes
+        continue
+    if _captured:
+        MOVE_SCORES[_index] = CAPTURE_SCORE + 10 * codeValues[_captured] - codeValues[_moved]
+    if _index & PROMOTION >> 12:
+        MOVE_SCORES[_index] = max(MOVE_SCORES[_index], CAPTURE_SCORE) + 9
+
+def setHashSize(sizeMB):
+    global transpositionTable
+    releaseSharedTable()
+    transpositionTable = TranspositionTable.TranspositionTable(sizeMB)
+
+def useSharedTable():
+    global transpositionTable, sharedMemory
+    if sharedMemory is None:
+        sizeMB = transpositionTable.sizeMB
+        sharedMemory = shared_memory.SharedMemory(create=True, size=TranspositionTable.tableBytes(sizeMB))
+        transpositionTable = TranspositionTable.TranspositionTable(sizeMB, sharedMemory.buf)
+
+@atexit.register
+def releaseSharedTable():
+    global transpositionTable, sharedMemory
+    if sharedMemory is not None:
+        sizeMB = transpositionTable.sizeMB
+        transpositionTable.release()
+        transpositionTable = TranspositionTable.TranspositionTable(sizeMB)
+        sharedMemory.close()
+        sharedMemory.unlink()
+        sharedMemory = None
+
+# (maxDepth, timeLimit, nodeLimit) of a search from the limits given, the settings fill in the ones that aren't.
+# A search bounded by time or nodes isn't held back by DEPTH
+def searchLimits(maxDepth=None, timeLimit=None, nodeLimit=None):
+    timeLimit = TIME_LIMIT if timeLimit is None else timeLimit
+    nodeLimit = NODE_LIMIT if nodeLimit is None else nodeLimit
+    if maxDepth is None:
+        maxDepth = MAX_SEARCH_DEPTH if timeLimit is not None or nodeLimit is not None else DEPTH
+    return maxDepth, timeLimit, nodeLimit
+
+# Settings for searches run in a pool worker process: no helper processes, and no book or cache,
+# the batch tools want what the search finds and run the same searches across processes
+def initPoolWorker():
+    global WORKERS
+    WORKERS = 1
+    setOpeningBook(None)
+    setSearchCache(None)
+
+def setOpeningBook(path):
+    global openingBook, bookLoaded, BOOK_PATH
+    if openingBook is not None:
+        openingBook.close()
+    BOOK_PATH = path
+    openingBook = OpeningBook.OpeningBook(path) if path is not None and os.path.exists(path) else None
+    bookLoaded = True
+
+def findBookMove(gs, validMoves):
+    if not bookLoaded:
+        setOpeningBook(BOOK_PATH)
+    if openingBook is None:
+        return None
+    return openingBook.findMove(gs, validMoves, BOOK_RANDOM)
+
+def setTablebasePath(path):
+    global tablebases, tablebasesLoaded, TABLEBASE_PATH
+    if tablebases is not None:
+        tablebases.close()
+    TABLEBASE_PATH = path
+    tablebases = Tablebase.Tablebases(path) if path is not None and os.path.isdir(path) else None
+    if tablebases is not None and len(tablebases.tables) == 0:
+        tablebases = None
+    tablebasesLoaded = True
+
+def setSearchCache(path):
+    global searchCache, searchCacheLoaded, SEARCH_CACHE_PATH
+    if searchCache is not None:
+        searchCache.close()
+    SEARCH_CACHE_PATH = path
+    searchCache = SearchCache.SearchCache(path, SEARCH_CACHE_ENTRIES, SEARCH_CACHE_AGE) if path is not None else None
+    searchCacheLoaded = True
+
+# Writes the results still buffered, the writer thread would die with the process
+@atexit.register
+def closeSearchCache():
+    if searchCache is not None:
+        searchCache.close()
+
+# Packed move, score, depth and principal variation of an earlier search of this position at least maxDepth deep
+def findCachedResult(gs, validMoves, maxDepth):
+    if not searchCacheLoaded:
+        setSearchCache(SEARCH_CACHE_PATH)
+    if searchCache is None:
+        return None
+    entry = searchCache.probe(gs.zobristKey)
+    if entry is None or entry[2] < maxDepth:
+        return None
+    for move in validMoves:
+        if move.packed == entry[0]: # Any other move means two positions share the key
+            return move, entry
+    return None
+
+# Exact score of a position covered by the tablebases from the side to move's point of view, None otherwise
+def tablebaseScore(gs):
+    entry = tablebases.probe(gs)
+    if entry is None:
+        return None
+    result, plies = entry
+    return result * (TABLEBASE_WIN - plies)
+
+# In a covered ending every move is scored from the tables, no search needed
+def findTablebaseMove(gs, validMoves):
+    if not tablebasesLoaded:
+        setTablebasePath(TABLEBASE_PATH)
+    if tablebases is None or tablebaseScore(gs) is None:
+        return None
+    bestMove = None
+    maxScore = -CHECKMATE
+    for move in validMoves:
+        gs.makeMove(move)
+        score = tablebaseScore(gs)
+        gs.undoMove()
+        score = 0 if score is None else -score # Leaving the tables means a capture into a bare material draw
+        if score > maxScore:
+            maxScore = score
+            bestMove = move
+    return bestMove
 
 def findRandomMove(validMoves):
     return validMoves[random.randint(0, len(validMoves) - 1)]
 
+class SearchTimeout(Exception):
+    pass
+
+# State of one search: limits, node count, and the killer and history tables that order quiet moves.
+# Killers are per ply and history persists across iterations, so each depth starts with what the last one learned
+class SearchContext():
+    def __init__(self, maxDepth, timeLimit=None, nodeLimit=None, stats=None, counting=None):
+        self.maxDepth = maxDepth
+        self.timeLimit = timeLimit
+        self.maxNodes = nodeLimit
+        self.deadline = None
+        self.stats = stats
+        self.counting = stats is not None if counting is None else counting # Keep the counters past nodes, only the stats read them
+        self.nodes = 0 # Quiescence nodes included
+        self.qnodes = 0 # Nodes past the horizon, the horizon nodes themselves count as search nodes
+        self.ttProbes = 0
+        self.ttHits = 0
+        self.cutoffs = 0
+        self.firstMoveCutoffs = 0
+        self.searchDepth = 0 # Depth of the iteration in progress
+        self.nextMove = None # Best root move of that iteration so far
+        self.killers = [[0, 0] for ply in range(maxDepth + 1)] # The last two quiet moves that caused a beta cutoff at each ply
+        self.history = [0] * 4096 # Quiet move cutoffs by from and to square, weighted by depth squared
+
+    def checkLimits(self):
+        if stopSignal is not None and stopSignal.is_set():
+            raise SearchTimeout()
+        if self.searchDepth == 1: # Always finish depth 1 so there is a move to play
+            return
+        if self.maxNodes is not None and self.nodes >= self.maxNodes:
+            raise SearchTimeout()
+        if self.deadline is not None and time.time() >= self.deadline:
+            raise SearchTimeout()
+
+    # Captures and promotions by MVV-LVA, then the killers of this ply, then quiet moves by history
+    def orderScores(self, moves, ply):
+        killer1, killer2 = self.killers[ply]
+        history = self.history
+        scores = []
+        for move in moves:
+            score = MOVE_SCORES[move >> 12]
+            if not score:
+                if move == killer1:
+                    score = KILLER_SCORE + 1
+                elif move == killer2:
+                    score = KILLER_SCORE
+                else:
+                    score = history[move & 4095]
+            scores.append(score)
+        return scores
+
+    def counters(self):
+        return (self.nodes, self.qnodes, self.ttProbes, self.ttHits, self.cutoffs, self.firstMoveCutoffs)
+
+    # Adds the counters of a helper process
+    def addCounters(self, counters):
+        self.nodes += counters[0]
+        self.qnodes += counters[1]
+        self.ttProbes += counters[2]
+        self.ttHits += counters[3]
+        self.cutoffs += counters[4]
+        self.firstMoveCutoffs += counters[5]
+
+    def recordCutoff(self, move, depth, ply, moveIndex):
+        if self.counting:
+            self.cutoffs += 1
+            if moveIndex == 0:
+                self.firstMoveCutoffs += 1
+        if MOVE_SCORES[move >> 12]: # Captures are already ordered well
+            return
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+        history = self.history
+        history[move & 4095] += depth * depth
+        if history[move & 4095] > MAX_HISTORY: # Age every entry so recent cutoffs count more and scores stay below killers
+            self.history = [value // 2 for value in history]
+
+# What a search did, for tuning the engine. The counters come from the SearchContext when the search ends,
+# depths holds one (depth, score, nodes, seconds, principal variation) record per finished iteration, with its own nodes and time
+class SearchStats():
+    def __init__(self, onProgress=None):
+        self.source = 'search' # 'book', 'tablebase' or 'cache' when the move was played without searching
+        self.onProgress = onProgress # Called with the stats after every finished depth
+        self.depth = 0
+        self.score = None
+        self.pv = [] # Packed moves
+        self.seconds = 0
+        self.depths = []
+        self.nodes = 0
+        self.qnodes = 0
+        self.ttProbes = 0
+        self.ttHits = 0
+        self.cutoffs = 0
+        self.firstMoveCutoffs = 0
+
+    def finishDepth(self, gs, context, depth, score, seconds):
+        self.depth = depth
+        self.score = score
+        self.pv = principalVariation(gs, context.nextMove, depth)
+        self.depths.append((depth, score, context.nodes - self.nodes, seconds - self.seconds, self.pv))
+        self.seconds = seconds
+        self.readCounters(context)
+        if self.onProgress is not None:
+            self.onProgress(self)
+
+    def readCounters(self, context):
+        self.nodes, self.qnodes, self.ttProbes, self.ttHits, self.cutoffs, self.firstMoveCutoffs = context.counters()
+
+    def nodesPerSecond(self):
+        return int(self.nodes / self.seconds) if self.seconds > 0 else 0
+
+    def ttHitRate(self):
+        return self.ttHits / self.ttProbes if self.ttProbes > 0 else 0
+
+    # Share of beta cutoffs caused by the first move tried, how good the move ordering is
+    def firstMoveCutoffRate(self):
+        return self.firstMoveCutoffs / self.cutoffs if self.cutoffs > 0 else 0
+
+    # Effective branching factor, how many times more nodes the last depth took than the one before
+    def branchingFactor(self):
+        if len(self.depths) < 2 or self.depths[-2][2] == 0:
+            return 0
+        return self.depths[-1][2] / self.depths[-2][2]
+
+    def pvNotation(self):
+        return [Move.fromPacked(move).getChessNotation() for move in self.pv]
+
+    def asDict(self):
+        return {
+            'source': self.source,
+            'depth': self.depth,
+            'score': self.score,
+            'pv': self.pvNotation(),
+            'seconds': round(self.seconds, 4),
+            'nodes': self.nodes,
+            'qnodes': self.qnodes,
+            'ttProbes': self.ttProbes,
+            'nps': self.nodesPerSecond(),
+            'ttHitRate': round(self.ttHitRate(), 4),
+            'firstMoveCutoffRate': round(self.firstMoveCutoffRate(), 4),
+            'branchingFactor': round(self.branchingFactor(), 2),
+            'depths': [{'depth': depth, 'score': score, 'nodes': nodes, 'seconds': round(seconds, 4),
+                        'pv': [Move.fromPacked(move).getChessNotation() for move in pv]}
+                       for depth, score, nodes, seconds, pv in self.depths],
+        }
+
 # Helper method to make first recursive call
-def findBestMove(gs, validMoves):
-    global nextMove,counter
-    counter = 0
-    nextMove = None
-    random.shuffle(validMoves)
-    #findBestMoveMinMax(gs, validMoves, DEPTH, gs.whiteToMove)
-    findMoveNegaMaxAlphaBeta(gs, validMoves, DEPTH, -CHECKMATE, CHECKMATE,1 if gs.whiteToMove else -1)
-    print(counter)
-    return nextMove
-
-def findBestMoveMinMax(gs, validMoves, depth, whiteToMove):
-    global nextMove,counter
-    counter += 1
+def findBestMove(gs, validMoves, maxDepth=None, timeLimit=None, nodeLimit=None, workers=None):
+    return findBestMoveWithStats(gs, validMoves, maxDepth, timeLimit, nodeLimit, workers)[0]
+
+# Same as findBestMove, also returns the SearchStats of the search (None when SEARCH_STATS is off)
+def findBestMoveWithStats(gs, validMoves, maxDepth=None, timeLimit=None, nodeLimit=None, workers=None, onProgress=None):
+    maxDepth = DEPTH if maxDepth is None else maxDepth
+    timeLimit = TIME_LIMIT if timeLimit is None else timeLimit
+    nodeLimit = NODE_LIMIT if nodeLimit is None else nodeLimit
+    workers = WORKERS if workers is None else workers
+    stats = SearchStats(onProgress) if SEARCH_STATS else None
+    bookMove = findBookMove(gs, validMoves)
+    if bookMove is not None:
+        if stats is not None:
+            stats.source = 'book'
+        return bookMove, stats
+    tablebaseMove = findTablebaseMove(gs, validMoves)
+    if tablebaseMove is not None:
+        if stats is not None:
+            stats.source = 'tablebase'
+        return tablebaseMove, stats
+    cached = findCachedResult(gs, validMoves, maxDepth)
+    if cached is not None:
+        if stats is not None:
+            stats.source = 'cache'
+            stats.depth, stats.score, stats.pv = cached[1][2], cached[1][1], cached[1][3]
+        return cached[0], stats
+    moves = [move.packed for move in validMoves] # The search only handles packed moves
+    random.shuffle(moves)
+    transpositionTable.newSearch()
+    context = SearchContext(maxDepth, timeLimit, nodeLimit, stats)
+    startTime = time.time()
+    #findBestMoveMinMax(gs, validMoves, DEPTH, gs.whiteToMove, context)
+    if workers > 1:
+        bestMove, depth, score = findBestMoveParallel(gs, moves, context, workers)
+    else:
+        bestMove, depth, score = iterativeDeepening(gs, moves, context)
+    if searchCache is not None and depth > 0:
+        # A proven mate ends the search early, store it as deep as was asked for so the same search is answered next time
+        cacheDepth = max(depth, maxDepth) if abs(score) >= CHECKMATE else depth
+        searchCache.store(gs.zobristKey, bestMove, score, cacheDepth, principalVariation(gs, bestMove, depth))
+    if stats is not None: # Helper processes add their counters after the main search finished
+        stats.readCounters(context)
+        stats.seconds = time.time() - startTime
+    for move in validMoves:
+        if move.packed == bestMove:
+            return move, stats
+    return None, stats
+
+# Runs in its own process so the UI keeps drawing while the engine thinks. The result goes back as a moveID, None when cancelled
+def findBestMoveProcess(gs, validMoves, returnQueue, stopEvent):
+    global stopSignal
+    stopSignal = stopEvent
+    bestMove = findBestMove(gs, validMoves)
+    closeSearchCache() # Exit handlers don't run when a process started by multiprocessing ends
+    returnQueue.put(None if bestMove is None or stopEvent.is_set() else bestMove.moveID)
+
+# Iterative deepening: each finished depth leaves its best moves in the transposition table to order the next one
+def iterativeDeepening(gs, validMoves, context, firstDepth=1, onDepthFinished=None):
+    if not tablebasesLoaded:
+        setTablebasePath(TABLEBASE_PATH)
+    startTime = time.time()
+    context.deadline = startTime + context.timeLimit if context.timeLimit is not None else None
+    movesLogLength = len(gs.movesLog)
+    bestMove, bestDepth, bestScore = None, 0, None
+    for depth in range(firstDepth, context.maxDepth + 1):
+        context.searchDepth = depth
+        try:
+            score = findMoveNegaMaxAlphaBeta(gs, validMoves, depth, -CHECKMATE, CHECKMATE, 1 if gs.whiteToMove else -1, context)
+        except SearchTimeout: # Take back the moves of the unfinished iteration and keep the last finished result
+            while len(gs.movesLog) > movesLogLength:
+                gs.undoMove()
+            break
+        bestMove, bestDepth, bestScore = context.nextMove, depth, score
+        if context.stats is not None:
+            context.stats.finishDepth(gs, context, depth, score, time.time() - startTime)
+        if onDepthFinished is not None:
+            onDepthFinished(depth, context.nextMove, score)
+        if abs(score) >= CHECKMATE:
+            break
+        # The next iteration takes several times longer than this one, don't start what can't finish
+        if context.deadline is not None and time.time() - startTime > context.timeLimit / 2:
+            break
+    return bestMove, bestDepth, bestScore
+
+# Lazy SMP: helper processes search the same root through a shared transposition table and the deepest finished result wins
+def findBestMoveParallel(gs, validMoves, context, workers):
+    useSharedTable()
+    results = multiprocessing.Queue()
+    stopEvent = multiprocessing.Event()
+    helpers = []
+    for workerIndex in range(1, workers):
+        helper = multiprocessing.Process(target=searchWorker, daemon=True,
+                                         args=(gs, validMoves, workerIndex, context.maxDepth, context.timeLimit, context.maxNodes,
+                                               sharedMemory.name, transpositionTable.sizeMB, transpositionTable.age, results, stopEvent,
+                                               context.counting))
+        helper.start()
+        helpers.append(helper)
+    bestMove, bestDepth, bestScore = iterativeDeepening(gs, validMoves, context)
+    stopEvent.set()
+    running = set(range(1, workers))
+    while running: # Drain the queue before joining, a helper can't exit while its messages are unread
+        try:
+            message = results.get(timeout=HELPER_POLL)
+        except queue.Empty: # A helper that was killed or failed to start never says it is done
+            running = {workerIndex for workerIndex in running if helpers[workerIndex - 1].is_alive()}
+            continue
+        if message[0] == 'done':
+            context.addCounters(message[2])
+            running.discard(message[1])
+        elif message[1] > bestDepth:
+            bestMove, bestDepth, bestScore = message[2], message[1], message[3]
+    for helper in helpers:
+        helper.join()
+    return bestMove, bestDepth, bestScore
+
+def searchWorker(gs, validMoves, workerIndex, maxDepth, timeLimit, nodeLimit, tableName, sizeMB, age, results, stopEvent, counting):
+    global transpositionTable, stopSignal
+    context = SearchContext(maxDepth, timeLimit, nodeLimit, counting=counting)
+    memory = table = None
+    try: # Whatever goes wrong, the main search hears that this helper is done
+        memory = shared_memory.SharedMemory(name=tableName)
+        table = TranspositionTable.TranspositionTable(sizeMB, memory.buf)
+        table.age = age
+        transpositionTable = table
+        stopSignal = stopEvent
+        # Helpers try the root moves in a different order and every other one starts a depth ahead,
+        # so they fill the table with parts of the tree the main search hasn't reached yet
+        random.Random(workerIndex).shuffle(validMoves)
+        iterativeDeepening(gs, validMoves, context, firstDepth=1 + workerIndex % 2,
+                           onDepthFinished=lambda depth, move, score: results.put(('depth', depth, move, score)))
+    finally:
+        results.put(('done', workerIndex, context.counters()))
+        if table is not None:
+            table.release()
+        if memory is not None:
+            memory.close()
+
+def findBestMoveMinMax(gs, validMoves, depth, whiteToMove, context):
+    context.nodes += 1
     if depth == 0:
         return scoreMaterial(gs)
     if whiteToMove:
@@ -100,11 +491,11 @@ def findBestMoveMinMax(gs, validMoves, depth, whiteToMove):
         for move in validMoves:
             gs.makeMove(move)
             nextMoves = gs.getValidMoves()
-            score = findBestMoveMinMax(gs, nextMoves, depth - 1, False)
+            score = findBestMoveMinMax(gs, nextMoves, depth - 1, False, context)
             if score > maxScore:
                 maxScore = score
-                if depth == DEPTH:
-                    nextMove = move
+                if depth == context.searchDepth:
+                    context.nextMove = move
             gs.undoMove()
         return maxScore
     else:
@@ -112,40 +503,210 @@ def findBestMoveMinMax(gs, validMoves, depth, whiteToMove):
         for move in validMoves:
             gs.makeMove(move)
             nextMoves = gs.getValidMoves()
-            score = findBestMoveMinMax(gs, nextMoves, depth -1, True)
+            score = findBestMoveMinMax(gs, nextMoves, depth -1, True, context)
             if score < minScore:
                 minScore = score
-                if depth == DEPTH:
-                    nextMove = move
+                if depth == context.searchDepth:
+                    context.nextMove = move
             gs.undoMove()
         return minScore
 
-def findMoveNegaMaxAlphaBeta(gs, validMoves, depth, alpha, beta, turnMultiplier):
-    global nextMove,counter
-    counter += 1
-    if depth == 0:
-        return turnMultiplier * scoreMaterial(gs)
-    
-    # Move ordering
-    validMoves.sort(key=scoreMove, reverse=True)
-    
-    #move order - Implement later
+def findMoveNegaMaxAlphaBeta(gs, validMoves, depth, alpha, beta, turnMultiplier, context, ply=0):
+    context.nodes += 1
+    if context.nodes & 63 == 0:
+        context.checkLimits()
+    if tablebases is not None and ply > 0:
+        score = tablebaseScore(gs)
+        if score is not None:
+            return score
+    alphaOriginal = alpha
+    hashMove = 0
+    entry = transpositionTable.probe(gs.zobristKey)
+    if context.counting:
+        context.ttProbes += 1
+        if entry is not None:
+            context.ttHits += 1
+    if entry is not None:
+        entryDepth, entryScore, bound, hashMove = entry
+        if entryDepth >= depth and ply > 0: # The root always searches so it can pick nextMove
+            if bound == TranspositionTable.EXACT:
+                return entryScore
+            elif bound == TranspositionTable.LOWER_BOUND:
+                alpha = max(alpha, entryScore)
+            else:
+                beta = min(beta, entryScore)
+            if alpha >= beta:
+                return entryScore
+    if depth == 0 and QUIESCENCE:
+        score = quiescenceSearch(gs, alpha, beta, turnMultiplier, context, True)
+        storeSearchResult(gs, 0, score, alphaOriginal, beta, None)
+        return score
+    if depth == 0: # Without quiescence, checkmate and stalemate only need to know whether any move exists
+        gs.hasLegalMove()
+        score = turnMultiplier * scoreMaterial(gs)
+        transpositionTable.store(gs.zobristKey, 0, score, TranspositionTable.EXACT, 0)
+        return score
+    killers = context.killers[ply]
+    if validMoves is None:
+        # Children generate their moves lazily, stage by stage, so a cutoff on the hash move or a capture skips the quiet moves
+        moves = gs.generateStagedMoves(hashMove, killers, lambda captures: orderMoves(gs, captures, context, depth, ply, turnMultiplier),
+                                       lambda quiets: orderMoves(gs, quiets, context, depth, ply, turnMultiplier))
+        inCheck = gs.inCheck # generateStagedMoves has just worked it out, before anything below changed it
+    else:
+        moves = validMoves
+        if len(moves) > 1:
+            moves[:] = orderMoves(gs, moves, context, depth, ply, turnMultiplier)
+        if hashMove:
+            for i in range(len(moves)):
+                if moves[i] == hashMove:
+                    moves.insert(0, moves.pop(i))
+                    break
+        inCheck = gs.isInCheck() # The root's moves come from the caller, the flag holds whatever the last search below left
+
+    # Null move: if passing the turn still fails high, a real move would too. Not in check, where passing is illegal,
+    # not twice in a row, and not when only the king and pawns can move, where passing can be better than any move (zugzwang)
+    if NULL_MOVE_PRUNING and ply > 0 and depth > NULL_MOVE_REDUCTION and not inCheck and abs(beta) < CHECKMATE and \
+            gs.movesLog[-1] != NULL_MOVE and turnMultiplier * scoreMaterial(gs) >= beta and hasPieces(gs):
+        gs.makeNullMove()
+        score = -findMoveNegaMaxAlphaBeta(gs, None, depth - 1 - NULL_MOVE_REDUCTION, -beta, -beta + NULL_WINDOW, -turnMultiplier,
+                                          context, ply + 1)
+        gs.undoMove()
+        if score >= beta:
+            return beta
+
     maxScore = -CHECKMATE
-    for move in validMoves:
+    bestMove = None
+    moveIndex = -1
+    reduce = LATE_MOVE_REDUCTIONS and depth >= LMR_MIN_DEPTH and not inCheck
+    for moveIndex, move in enumerate(moves):
             gs.makeMove(move)
-            nextMoves = gs.getValidMoves()
-            score = -findMoveNegaMaxAlphaBeta(gs, nextMoves, depth - 1, -beta, -alpha, -turnMultiplier)
+            # Late quiet moves that don't give check are searched with a null window one ply shallower first
+            if reduce and moveIndex >= LMR_MIN_MOVES and not MOVE_SCORES[move >> 12] and move != killers[0] and \
+                    move != killers[1] and not gs.isInCheck():
+                score = -findMoveNegaMaxAlphaBeta(gs, None, depth - 2, -alpha - NULL_WINDOW, -alpha, -turnMultiplier, context, ply + 1)
+                if score > alpha:
+                    score = -findMoveNegaMaxAlphaBeta(gs, None, depth - 1, -beta, -alpha, -turnMultiplier, context, ply + 1)
+            else:
+                score = -findMoveNegaMaxAlphaBeta(gs, None, depth - 1, -beta, -alpha, -turnMultiplier, context, ply + 1)
             if score > maxScore:
                 maxScore = score
-                if depth == DEPTH:
-                    nextMove = move
+                bestMove = move
+                if ply == 0:
+                    context.nextMove = move
             gs.undoMove()
             if maxScore > alpha:
                 alpha = maxScore
             if alpha >= beta:
+                context.recordCutoff(move, depth, ply, moveIndex)
                 break
+    if moveIndex < 0: # No legal move
+        score = -CHECKMATE if inCheck else STALEMATE
+        transpositionTable.store(gs.zobristKey, depth, score, TranspositionTable.EXACT, 0)
+        return score
+    storeSearchResult(gs, depth, maxScore, alphaOriginal, beta, bestMove)
     return maxScore
 
+# Captures and promotions by MVV-LVA, then killers, then quiet moves by history.
+# At the frontier moves the ordering scores can't tell apart go by the static score of the position they lead to
+def orderMoves(gs, moves, context, depth, ply, turnMultiplier):
+    orderScores = context.orderScores(moves, ply)
+    if depth == 1:
+        childScores = turnMultiplier * scoreChildren(gs, moves)
+        return [moves[i] for i in np.lexsort((-childScores, -np.array(orderScores)))]
+    return [moves[i] for i in sorted(range(len(moves)), key=orderScores.__getitem__, reverse=True)]
+
+# Whether the side to move has a piece other than the king and pawns, positions without one are prone to zugzwang
+def hasPieces(gs):
+    board = gs.board
+    ally = 0 if gs.whiteToMove else BLACK
+    for sq in SQUARE120:
+        pieceType = board[sq] - ally
+        if PAWN < pieceType < KING:
+            return True
+    return False
+
+# The line the search expects, following the best moves stored in the transposition table from the root
+def principalVariation(gs, bestMove, length):
+    pv = []
+    seen = set()
+    inCheck = gs.inCheck # isLegalMove sets it for the positions along the line
+    move = bestMove
+    while move and len(pv) < length and gs.zobristKey not in seen and gs.isLegalMove(move):
+        seen.add(gs.zobristKey)
+        pv.append(move)
+        gs.makeMove(move)
+        entry = transpositionTable.probe(gs.zobristKey)
+        move = entry[3] if entry is not None else 0
+    for move in pv:
+        gs.undoMove()
+    gs.inCheck = inCheck
+    return pv
+
+def storeSearchResult(gs, depth, score, alphaOriginal, beta, bestMove):
+    if score <= alphaOriginal:
+        bound = TranspositionTable.UPPER_BOUND
+    elif score >= beta:
+        bound = TranspositionTable.LOWER_BOUND
+    else:
+        bound = TranspositionTable.EXACT
+    transpositionTable.store(gs.zobristKey, depth, score, bound, bestMove if bestMove is not None else 0)
+
+# Only captures and promotions are searched past the horizon so leaves are never scored in the middle of an exchange.
+# The horizon node the search hands over was already counted there
+def quiescenceSearch(gs, alpha, beta, turnMultiplier, context, horizon=False):
+    if not horizon:
+        context.nodes += 1
+        if context.counting:
+            context.qnodes += 1
+        if context.nodes & 63 == 0:
+            context.checkLimits()
+    moves = gs.generateCaptures()
+    inCheck = gs.inCheck # When in check every evasion is searched and standing pat is not allowed
+    if inCheck:
+        if len(moves) == 0:
+            return -CHECKMATE
+        maxScore = -CHECKMATE
+    else:
+        standPat = turnMultiplier * scoreMaterial(gs)
+        if standPat >= beta:
+            return standPat
+        if standPat > alpha:
+            alpha = standPat
+        maxScore = standPat
+    moves.sort(key=scoreMove, reverse=True)
+    for move in moves:
+        # Delta pruning, even winning the captured piece for free would not reach alpha
+        if not inCheck and not move & PROMOTION and standPat + codeValues[move >> CAPTURED_SHIFT & 15] + DELTA_MARGIN <= alpha:
+            continue
+        gs.makeMove(move)
+        score = -quiescenceSearch(gs, -beta, -alpha, -turnMultiplier, context)
+        gs.undoMove()
+        if score > maxScore:
+            maxScore = score
+        if maxScore > alpha:
+            alpha = maxScore
+        if alpha >= beta:
+            break
+    return maxScore
+
+# Static score of every child of gs without playing the moves: only the squares each move touches are gathered
+def scoreChildren(gs, moves):
+    moves = np.array(moves)
+    start = moves & 63
+    end = moves >> 6 & 63
+    moved = moves >> MOVED_SHIFT & 15
+    landed = np.where(moves & PROMOTION, moved + 4, moved) # A promoted pawn's code plus 4 is the queen of its color
+    captured = moves >> CAPTURED_SHIFT & 15
+    captureSquare = np.where(moves & EN_PASSANT, start & 56 | end & 7, end)
+    deltas = pieceSquareArray[landed, end] - pieceSquareArray[moved, start] - pieceSquareArray[captured, captureSquare]
+    for i in np.flatnonzero(moves & CASTLE):
+        rookValues = pieceSquareValues[PIECE_NAMES[moved[i]][0] + 'R']
+        if end[i] - start[i] == 2: # Kingside castle
+            deltas[i] += rookValues[end[i] - 1] - rookValues[end[i] + 1]
+        else: # Queenside castle
+            deltas[i] += rookValues[end[i] + 1] - rookValues[end[i] - 2]
+    return (gs.evaluation + deltas) / 10
+
 # positive score is good for white and negative for black
 def scoreMaterial(gs):
     if gs.checkMate:
@@ -155,29 +716,8 @@ def scoreMaterial(gs):
             return CHECKMATE # White wins
     if gs.staleMate:
         return STALEMATE
-    score = 0
-    for row in range(len(gs.board)):
-        for col in range(len(gs.board[row])):
-            square = gs.board[row][col]
-            if square != "--":
-                piecePositionScore = 0
-                if square[1]!='K':
-                    if square[1] == 'P':
-                        piecePositionScore = piecePositionScores[square][row][col]
-                    else:
-                        piecePositionScore = piecePositionScores[square[1]][row][col]
-                if square[0] == 'w':
-                    score += pieceValue[square[1]] + piecePositionScore*0.1
-                elif square[0] == 'b':
-                    score -= pieceValue[square[1]] + piecePositionScore*0.1
-    return score
+    return gs.evaluation / 10 # GameState keeps material and position scores in tenths of a pawn
 
 
 def scoreMove(move):
-    captureScore = 0
-    if move.pieceCaptured != "--":
-        captureScore += 10 * pieceValue[move.pieceCaptured[1]] - pieceValue[move.pieceMoved[1]]
-    promotionBonus = 9 if move.pawnPromotion else 0
-    castleBonus = 2 if move.isCastleMove else 0
-    return captureScore + promotionBonus + castleBonus
-
+    return MOVE_SCORES[move >> 12]
@@ -0,0 +1,97 @@
+# Opening book: a sorted file of fixed size entries keyed by Zobrist hash, probed by binary search over an mmap
+# so opening it costs the same however big the book is. Keys come from ChessEngine's Zobrist tables, rebuild the book if they change
+# Usage: python OpeningBook.py games.pgn [more.pgn ...] [--output opening_book.bin] [--plies 16] [--min-games 2]
+
+import argparse
+import mmap
+import os
+import random
+import struct
+import sys
+import ChessEngine
+from PGN import moveFromSAN, readGames
+
+ENTRY = struct.Struct('>QHH') # key, move as from square << 6 | to square, weight (number of games that played it)
+MAX_WEIGHT = 0xFFFF
+DEFAULT_PLIES = 16
+
+def encodeMove(move):
+    return (move.startRow * 8 + move.startCol) << 6 | move.endRow * 8 + move.endCol
+
+class OpeningBook():
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        self.entryCount = size // ENTRY.size
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else b''
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.file.close()
+
+    # All (move, weight) pairs stored for the position
+    def probe(self, key):
+        low, high = 0, self.entryCount
+        while low < high: # First entry with a key not below the one searched
+            middle = (low + high) // 2
+            if ENTRY.unpack_from(self.data, middle * ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        entries = []
+        while low < self.entryCount:
+            entryKey, move, weight = ENTRY.unpack_from(self.data, low * ENTRY.size)
+            if entryKey != key:
+                break
+            entries.append((move, weight))
+            low += 1
+        return entries
+
+    # The most played book move, or one picked in proportion to how often it was played. None once out of book
+    def findMove(self, gs, validMoves, randomize=False):
+        movesByCode = {encodeMove(move): move for move in validMoves}
+        candidates = [(movesByCode[move], weight) for move, weight in self.probe(gs.zobristKey) if move in movesByCode]
+        if len(candidates) == 0:
+            return None
+        if randomize:
+            return random.choices([move for move, weight in candidates], [weight for move, weight in candidates])[0]
+        return max(candidates, key=lambda candidate: candidate[1])[0]
+
+# Counts how often each move was played in each position over the first plies of every game, then writes the sorted entries
+def buildBook(pgnPaths, outputPath, plies=DEFAULT_PLIES, minGames=1):
+    counts = {}
+    games = 0
+    for path in pgnPaths:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for game in readGames(f):
+                if 'FEN' in game.tags: # Set up from a position, not an opening
+                    continue
+                games += 1
+                gs = ChessEngine.GameState()
+                for san in game.moves[:plies]:
+                    move = moveFromSAN(san, gs.getValidMoves())
+                    if move is None: # Stop at the first move we can't follow, everything after it would be misplaced
+                        break
+                    entry = (gs.zobristKey, encodeMove(move))
+                    counts[entry] = counts.get(entry, 0) + 1
+                    gs.makeMove(move)
+    entries = sorted((key, move, min(count, MAX_WEIGHT)) for (key, move), count in counts.items() if count >= minGames)
+    with open(outputPath, 'wb') as f:
+        for entry in entries:
+            f.write(ENTRY.pack(*entry))
+    return games, len(entries)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build an opening book from PGN games")
+    parser.add_argument('pgn', nargs='+')
+    parser.add_argument('--output', default="opening_book.bin")
+    parser.add_argument('--plies', type=int, default=DEFAULT_PLIES, help="Moves of each game that go into the book")
+    parser.add_argument('--min-games', type=int, default=1, help="Drop moves played in fewer games than this")
+    args = parser.parse_args(argv)
+    games, entries = buildBook(args.pgn, args.output, args.plies, args.min_games)
+    print(str(games) + " games, " + str(entries) + " entries written to " + args.output)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
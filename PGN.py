@@ -0,0 +1,264 @@
+# PGN games and SAN moves. readGames streams a file one game at a time, so archives of any size replay in bounded memory
+# Usage: python PGN.py games.pgn [more.pgn ...] [--output clean.pgn] replays every game, checking each move, and can
+# write them back out in export format
+
+import argparse
+import re
+import sys
+import ChessEngine
+from ChessEngine import Move, START_FEN
+
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+SEVEN_TAG_ROSTER = ('Event', 'Site', 'Date', 'Round', 'White', 'Black', 'Result')
+LINE_LENGTH = 79
+
+class PGNGame():
+    def __init__(self, tags=None, moves=None, result='*'):
+        self.tags = tags if tags is not None else {} # Tag name -> value
+        self.moves = moves if moves is not None else [] # SAN tokens
+        self.result = result
+
+    # Starting position: the FEN tag of games set up from a position, the initial position otherwise
+    def startFEN(self):
+        return self.tags.get('FEN', START_FEN)
+
+# Standard Algebraic Notation of a legal move, with disambiguation, promotion piece and check or mate mark
+def moveToSAN(gs, move, validMoves):
+    if move.isCastleMove:
+        san = 'O-O' if move.endCol == 6 else 'O-O-O'
+    else:
+        piece = move.pieceMoved[1]
+        target = move.getRankFile(move.endRow, move.endCol)
+        if piece == 'P':
+            san = (Move.colsToFiles[move.startCol] + 'x' if move.isCapture else '') + target
+            if move.pawnPromotion:
+                san += '=Q'
+        else:
+            # Other pieces of the same kind that can reach the same square decide how much of the start square is needed
+            others = [other for other in validMoves if other.pieceMoved == move.pieceMoved and other.endRow == move.endRow and
+                      other.endCol == move.endCol and (other.startRow != move.startRow or other.startCol != move.startCol)]
+            hint = ''
+            if others:
+                if all(other.startCol != move.startCol for other in others):
+                    hint = Move.colsToFiles[move.startCol]
+                elif all(other.startRow != move.startRow for other in others):
+                    hint = Move.rowsToRanks[move.startRow]
+                else:
+                    hint = move.getRankFile(move.startRow, move.startCol)
+            san = piece + hint + ('x' if move.isCapture else '') + target
+    gs.makeMove(move)
+    if gs.isInCheck():
+        san += '+' if gs.hasLegalMove() else '#'
+    gs.undoMove()
+    return san
+
+# Finds the move a SAN token like "Nbd7", "exd5", "e8=Q" or "O-O" stands for, None if it isn't legal or is ambiguous.
+# Check marks and annotations are optional. The engine only promotes to a queen, so under-promotions are never found
+def moveFromSAN(san, validMoves):
+    san = re.sub(r'(e\.p\.)?[+#!?]*$', '', san)
+    if san in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+        endCol = 6 if len(san) == 3 else 2
+        for move in validMoves:
+            if move.isCastleMove and move.endCol == endCol:
+                return move
+        return None
+    if '=' in san:
+        san, promotion = san.split('=', 1)
+        if promotion != 'Q':
+            return None
+    elif len(san) > 2 and san[-1] in 'QRBN' and san[-2].isdigit():
+        if san[-1] != 'Q':
+            return None
+        san = san[:-1]
+    if len(san) < 2 or san[-2] not in 'abcdefgh' or san[-1] not in '12345678':
+        return None
+    piece = san[0] if san[0] in 'KQRBN' else 'P'
+    endRow = Move.ranksToRows[san[-1]]
+    endCol = Move.filesToCols[san[-2]]
+    hint = san[1 if piece != 'P' else 0:-2].replace('x', '')
+    candidates = []
+    for move in validMoves:
+        if move.pieceMoved[1] != piece or move.endRow != endRow or move.endCol != endCol or move.isCastleMove:
+            continue
+        if any(c in 'abcdefgh' and move.startCol != Move.filesToCols[c] or
+               c in '12345678' and move.startRow != Move.ranksToRows[c] for c in hint):
+            continue
+        candidates.append(move)
+    return candidates[0] if len(candidates) == 1 else None
+
+TAG = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+
+# Yields the games of a PGN file, or any iterable of lines, one PGNGame at a time. Comments, variations, NAGs and move
+# numbers are skipped. Only the game being read is kept in memory
+def readGames(lines):
+    tags = {}
+    movetext = []
+    inComment, depth = False, 0 # A tag line inside a brace comment or a variation doesn't start a new game
+    for line in lines:
+        if line.startswith('%'): # Escape line
+            continue
+        stripped = line.strip()
+        if not inComment and depth == 0 and stripped.startswith('['):
+            if movetext:
+                yield parseMovetext(tags, movetext)
+                tags, movetext = {}, []
+            match = TAG.match(stripped)
+            if match:
+                tags[match.group(1)] = match.group(2).replace('\\"', '"').replace('\\\\', '\\')
+            continue
+        if stripped:
+            movetext.append(stripped)
+            inComment, depth = scanLine(stripped, inComment, depth)
+    if tags or movetext:
+        yield parseMovetext(tags, movetext)
+
+# Whether a brace comment is still open and how many variations are, after a line of movetext.
+# Brace comments don't nest and a ; comment runs to the end of the line
+def scanLine(line, inComment, depth):
+    for c in line:
+        if inComment:
+            inComment = c != '}'
+        elif c == '{':
+            inComment = True
+        elif c == ';':
+            break
+        elif c == '(':
+            depth += 1
+        elif c == ')' and depth > 0:
+            depth -= 1
+    return inComment, depth
+
+def parseMovetext(tags, lines):
+    # Whichever comment starts first wins, so a ; inside braces stays part of the brace comment
+    movetext = re.sub(r'\{[^}]*\}|;[^\n]*', ' ', '\n'.join(lines))
+    while '(' in movetext: # Innermost variations first so nested ones come out too
+        stripped = re.sub(r'\([^()]*\)', ' ', movetext)
+        if stripped == movetext:
+            break
+        movetext = stripped
+    moves = []
+    result = tags.get('Result', '*')
+    for token in movetext.split():
+        token = re.sub(r'^\d+\.+', '', token)
+        if token in RESULTS:
+            result = token
+        elif token and not token.startswith('$'):
+            moves.append(token)
+    return PGNGame(tags, moves, result)
+
+# Plays a game on a new GameState (or gs), yielding each Move before it is made. Stops quietly at the first move that
+# isn't legal, the caller can compare how many moves came out with len(game.moves)
+def replayGame(game, gs=None):
+    if gs is None:
+        gs = ChessEngine.GameState()
+        gs.loadFEN(game.startFEN())
+    for san in game.moves:
+        move = moveFromSAN(san, gs.getValidMoves())
+        if move is None:
+            return
+        yield move
+        gs.makeMove(move)
+
+# Game result from the final position, '*' while the game is still going
+def gameResult(gs):
+    validMoves = gs.getValidMoves()
+    if len(validMoves) > 0:
+        return '*'
+    if gs.inCheck:
+        return '0-1' if gs.whiteToMove else '1-0'
+    return '1/2-1/2'
+
+# SAN of every move in gs.movesLog. The moves are taken back to the start and replayed, gs ends where it was
+def movesLogToSAN(gs):
+    moves = []
+    while len(gs.movesLog) > 0:
+        moves.append(gs.movesLog[-1])
+        gs.undoMove()
+    startFEN = gs.getFEN()
+    sans = []
+    for move in reversed(moves):
+        validMoves = gs.getValidMoves()
+        sans.append(moveToSAN(gs, Move.fromPacked(move), validMoves))
+        gs.makeMove(move)
+    return startFEN, sans
+
+# Writes the game played on gs as PGN in export format: the seven tag roster first, then any other tags
+def writeGame(f, gs, tags=None, result=None):
+    tags = dict(tags) if tags is not None else {}
+    startFEN, sans = movesLogToSAN(gs)
+    result = result if result is not None else tags.get('Result', gameResult(gs))
+    tags['Result'] = result
+    if startFEN.split()[:4] != START_FEN.split()[:4] and 'FEN' not in tags:
+        tags['SetUp'] = '1'
+        tags['FEN'] = startFEN
+    defaults = {'Event': '?', 'Site': '?', 'Date': '????.??.??', 'Round': '?', 'White': '?', 'Black': '?'}
+    for name in SEVEN_TAG_ROSTER:
+        f.write('[' + name + ' "' + escapeTag(tags.get(name, defaults.get(name, ''))) + '"]\n')
+    for name, value in tags.items():
+        if name not in SEVEN_TAG_ROSTER:
+            f.write('[' + name + ' "' + escapeTag(value) + '"]\n')
+    f.write('\n')
+    fields = startFEN.split()
+    moveNumber = int(fields[5]) if len(fields) > 5 else 1
+    whiteToMove = fields[1] == 'w'
+    tokens = []
+    for i, san in enumerate(sans):
+        if whiteToMove:
+            tokens.append(str(moveNumber) + '.')
+        elif i == 0: # A game set up with black to move starts with the move number and an ellipsis
+            tokens.append(str(moveNumber) + '...')
+        tokens.append(san)
+        if not whiteToMove:
+            moveNumber += 1
+        whiteToMove = not whiteToMove
+    tokens.append(result)
+    line = ''
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > LINE_LENGTH:
+            f.write(line + '\n')
+            line = token
+        else:
+            line = line + ' ' + token if line else token
+    f.write(line + '\n\n')
+
+def escapeTag(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+# Replays every game of the files, checking each move, and writes them back out in export format when output is given
+def replayFiles(paths, output=None):
+    games = plies = failed = 0
+    for path in paths:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for game in readGames(f):
+                gs = ChessEngine.GameState()
+                try:
+                    gs.loadFEN(game.startFEN())
+                except (ValueError, KeyError, IndexError):
+                    failed += 1
+                    continue
+                played = sum(1 for move in replayGame(game, gs))
+                games += 1
+                plies += played
+                if played < len(game.moves):
+                    failed += 1
+                if output is not None:
+                    tags = {name: value for name, value in game.tags.items() if name not in ('SetUp', 'FEN')}
+                    writeGame(output, gs, tags, game.result if played == len(game.moves) else '*')
+    return games, plies, failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay PGN games, checking every move, and optionally write them back out")
+    parser.add_argument('pgn', nargs='+')
+    parser.add_argument('--output', help="Write the replayed games to this PGN file")
+    args = parser.parse_args(argv)
+    output = open(args.output, 'w') if args.output else None
+    try:
+        games, plies, failed = replayFiles(args.pgn, output)
+    finally:
+        if output is not None:
+            output.close()
+    sys.stderr.write(str(games) + " games, " + str(plies) + " plies, " + str(failed) + " with a move that couldn't be played\n")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
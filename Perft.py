@@ -0,0 +1,95 @@
+# Perft counts the leaves of the legal move tree. Known totals check move generation and the timing tracks its speed
+# Usage: python Perft.py --depth 3 [--positions start kiwipete] [--fen FEN] [--divide] [--backend bitboard] [--output perft.json]
+
+import argparse
+import json
+import sys
+import time
+import ChessEngine
+import BitboardEngine
+
+# Expected totals only count promotions to a queen, the engine never under-promotes
+POSITIONS = {
+    'start': ("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1", [20, 400, 8902, 197281]),
+    'kiwipete': ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", [48, 2039, 97862, 4074224]),
+    'position3': ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", [14, 191, 2812, 43238]),
+    'position4': ("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1", [6, 228, 8087, 320802]),
+    'position5': ("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", [41, 1373, 54007, 1806790]),
+    'position6': ("r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10", [46, 2079, 89890, 3894594]),
+    'promotion': ("n1n5/PPPk4/8/8/8/8/4Kppp/5N1N b - - 0 1", [15, 210, 3253, 47828]),
+}
+
+BACKENDS = {'bitboard': BitboardEngine.BitboardGameState, 'mailbox': ChessEngine.GameState}
+
+def perft(gs, depth):
+    if depth == 0:
+        return 1
+    moves = gs.generateMoves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.makeMove(move)
+        nodes += perft(gs, depth - 1)
+        gs.undoMove()
+    return nodes
+
+# Node count below each root move, to find which move a wrong total comes from
+def divide(gs, depth):
+    counts = {}
+    for move in gs.getValidMoves():
+        gs.makeMove(move)
+        counts[move.getRankFile(move.startRow, move.startCol) + move.getRankFile(move.endRow, move.endCol)] = perft(gs, depth - 1)
+        gs.undoMove()
+    return counts
+
+def runPerft(name, fen, depth, expected=None, backend='mailbox', showDivide=False):
+    gs = BACKENDS[backend]()
+    gs.loadFEN(fen)
+    start = time.perf_counter()
+    if showDivide:
+        counts = divide(gs, depth)
+        nodes = sum(counts.values())
+    else:
+        nodes = perft(gs, depth)
+    seconds = time.perf_counter() - start
+    result = {'position': name, 'fen': fen, 'backend': backend, 'depth': depth, 'nodes': nodes,
+              'seconds': round(seconds, 4), 'nps': int(nodes / seconds) if seconds > 0 else None}
+    if expected is not None and depth <= len(expected):
+        result['expected'] = expected[depth - 1]
+        result['ok'] = nodes == expected[depth - 1]
+    if showDivide:
+        result['divide'] = counts
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perft node counts and move generation speed")
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--positions', nargs='+', choices=sorted(POSITIONS), default=list(POSITIONS))
+    parser.add_argument('--fen', help="Run a single custom position instead of the standard set")
+    parser.add_argument('--divide', action='store_true', help="Report the node count below each root move")
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='mailbox', help="The mailbox is the faster one and the one ChessMain plays with")
+    parser.add_argument('--output', help="Write the JSON report to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    if args.fen:
+        runs = [('custom', args.fen, None)]
+    else:
+        runs = [(name, POSITIONS[name][0], POSITIONS[name][1]) for name in args.positions]
+    results = []
+    for name, fen, expected in runs:
+        results.append(runPerft(name, fen, args.depth, expected, args.backend, args.divide))
+    totalNodes = sum(result['nodes'] for result in results)
+    totalSeconds = sum(result['seconds'] for result in results)
+    report = {'depth': args.depth, 'backend': args.backend, 'results': results, 'nodes': totalNodes,
+              'seconds': round(totalSeconds, 4), 'nps': int(totalNodes / totalSeconds) if totalSeconds > 0 else None}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0 if all(result.get('ok', True) for result in results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+# Search results kept on disk between sessions: best move, score, depth and principal variation by Zobrist key.
+# A single SQLite file, so any number of runs can share it. New results and hits are buffered and written in batches
+# by one long-lived background thread, so the search never waits for the disk. Past maxEntries the least recently used results
+# are evicted, and results not used for maxAge seconds too
+
+import queue
+import sqlite3
+import threading
+import time
+
+COMMIT_EVERY = 64 # Results and hits buffered before a batch is written
+MAX_QUEUED_BATCHES = 4 # Batches waiting for the writer, past this new results stay buffered until it catches up
+
+# Zobrist keys are unsigned 64 bit, SQLite integers are signed
+def sqlKey(key):
+    return key - (1 << 63)
+
+class SearchCache():
+    def __init__(self, path, maxEntries=None, maxAge=None):
+        self.path = path
+        self.maxEntries = maxEntries
+        self.maxAge = maxAge
+        self.connection = None # Opened by the first probe, so a cache that is never used costs nothing
+        self.lock = threading.Lock()
+        self.pending = {} # Key -> (move, score, depth, pv) not written yet
+        self.touched = {} # Key -> time of the last hit not written yet
+        self.writing = {} # Results of the batches handed to the writer, still probed until they are committed
+        self.batches = queue.Queue(MAX_QUEUED_BATCHES) # (results, hits) for the writer, None to stop it
+        self.writer = None # Started by the first flush
+
+    def connect(self):
+        # Searches may run on another thread than the one that closes the cache, e.g. in the UCI front end
+        connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL") # Readers don't wait for the writer
+        connection.execute("CREATE TABLE IF NOT EXISTS results (key INTEGER PRIMARY KEY, move INTEGER NOT NULL, "
+                           "score REAL NOT NULL, depth INTEGER NOT NULL, pv TEXT NOT NULL, used REAL NOT NULL)")
+        if 'used' not in [column[1] for column in connection.execute("PRAGMA table_info(results)")]: # Written before eviction
+            # Results count as used now, a time of 0 would make maxAge drop every one of them on the next write
+            connection.execute("ALTER TABLE results ADD COLUMN used REAL NOT NULL DEFAULT 0")
+            connection.execute("UPDATE results SET used = ?", (time.time(),))
+            connection.commit()
+        connection.execute("CREATE INDEX IF NOT EXISTS resultsUsed ON results (used)")
+        return connection
+
+    # (packed move, score for the side to move, depth, packed principal variation) or None
+    def probe(self, key):
+        with self.lock:
+            entry = self.pending.get(key) or self.writing.get(key)
+            if entry is not None:
+                self.touched[key] = time.time()
+                return entry
+            if self.connection is None:
+                self.connection = self.connect()
+            row = self.connection.execute("SELECT move, score, depth, pv FROM results WHERE key = ?", (sqlKey(key),)).fetchone()
+            if row is None:
+                return None
+            self.touched[key] = time.time()
+        return row[0], row[1], row[2], [int(move) for move in row[3].split()]
+
+    # Keeps the deeper of the stored and the new result
+    def store(self, key, move, score, depth, pv):
+        with self.lock:
+            entry = self.pending.get(key)
+            if entry is None or depth >= entry[2]:
+                self.pending[key] = (move, score, depth, list(pv))
+            full = len(self.pending) + len(self.touched) >= COMMIT_EVERY
+        if full:
+            self.flush()
+
+    # Hands the buffered results and hits to the writer thread. Never blocks unless wait is set, then it returns once
+    # everything is on disk. When the writer is behind the results stay buffered and go with the next batch
+    def flush(self, wait=False):
+        while True:
+            with self.lock:
+                if self.writer is None:
+                    self.writer = threading.Thread(target=self.writeBatches, daemon=True)
+                    self.writer.start()
+                if not self.pending and not self.touched:
+                    break
+                try:
+                    self.batches.put_nowait((self.pending, self.touched))
+                    self.writing.update(self.pending)
+                    self.pending, self.touched = {}, {}
+                    break
+                except queue.Full:
+                    if not wait:
+                        break
+            self.batches.join() # Outside the lock, the writer takes it to finish a batch
+        if wait:
+            self.batches.join()
+
+    def writeBatches(self):
+        while True:
+            item = self.batches.get()
+            try:
+                if item is None:
+                    return
+                self.write(*item)
+            finally:
+                self.batches.task_done()
+
+    def write(self, batch, touched):
+        connection = self.connect()
+        try:
+            now = time.time()
+            connection.executemany("INSERT INTO results (key, move, score, depth, pv, used) VALUES (?, ?, ?, ?, ?, ?) "
+                                   "ON CONFLICT(key) DO UPDATE SET move = excluded.move, score = excluded.score, "
+                                   "depth = excluded.depth, pv = excluded.pv WHERE excluded.depth >= results.depth",
+                                   [(sqlKey(key), move, score, depth, ' '.join(str(move) for move in pv), now)
+                                    for key, (move, score, depth, pv) in batch.items()])
+            touched.update((key, now) for key in batch)
+            connection.executemany("UPDATE results SET used = ? WHERE key = ?", [(used, sqlKey(key)) for key, used in touched.items()])
+            if self.maxAge is not None:
+                connection.execute("DELETE FROM results WHERE used < ?", (now - self.maxAge,))
+            if self.maxEntries is not None:
+                excess = connection.execute("SELECT COUNT(*) FROM results").fetchone()[0] - self.maxEntries
+                if excess > 0:
+                    connection.execute("DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY used LIMIT ?)", (excess,))
+            connection.commit()
+        finally:
+            connection.close()
+            with self.lock:
+                for key, entry in batch.items():
+                    if self.writing.get(key) is entry: # Not replaced by a later batch
+                        del self.writing[key]
+
+    def __len__(self):
+        self.flush(wait=True)
+        with self.lock:
+            if self.connection is None:
+                self.connection = self.connect()
+            return self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    # Writes everything still buffered and stops the writer
+    def close(self):
+        self.flush(wait=True)
+        if self.writer is not None:
+            self.batches.put(None)
+            self.writer.join()
+            self.writer = None
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
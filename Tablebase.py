@@ -0,0 +1,309 @@
+# Endgame tablebases for a lone king against KQ, KR, KP and KBN, built by retrograde analysis.
+# One byte per position holds the plies to mate: odd when the side to move mates, even when it gets mated, DRAW otherwise.
+# Tables are files of raw bytes probed through mmap. Rules match GameState: pawns only promote to a queen
+# Usage: python Tablebase.py [KQK KRK KPK KBNK] [--output tablebases]
+
+import argparse
+import itertools
+import mmap
+import os
+import sys
+import time
+from array import array
+from ChessEngine import PIECE_NAMES, EMPTY, SQUARE120
+from BitboardEngine import KNIGHT_ATTACKS, KING_ATTACKS, PAWN_ATTACKS, ROOK_RAYS, BISHOP_RAYS, PIECES, slidingAttacks
+
+# Pieces of the stronger side besides its king, in the order their squares are indexed
+MATERIALS = {'KQK': 'Q', 'KRK': 'R', 'KPK': 'P', 'KBNK': 'BN'}
+PIECE_ORDER = 'QRBNP'
+DRAW = 255 # Also stored for positions that can't occur
+ESCAPE = 255 # Move counter of a position the weaker side can always draw from
+MAX_PIECES = 4
+
+# Tables without pawns use the 8 symmetries of the board to keep the weaker king in the a8-d8-d5 triangle
+def _transform(flipRows, flipCols, swap):
+    table = []
+    for sq in range(64):
+        r, c = sq // 8, sq % 8
+        if flipRows:
+            r = 7 - r
+        if flipCols:
+            c = 7 - c
+        if swap:
+            r, c = c, r
+        table.append(r * 8 + c)
+    return table
+
+TRANSFORMS = [_transform(flipRows, flipCols, swap) for flipRows in (False, True) for flipCols in (False, True) for swap in (False, True)]
+TRIANGLE = [r * 8 + c for r in range(4) for c in range(r + 1)]
+TRIANGLE_INDEX = {sq: i for i, sq in enumerate(TRIANGLE)}
+# Symmetries that bring a king on each square into the triangle (two of them for squares on the diagonal)
+KING_TRANSFORMS = [[t for t in TRANSFORMS if t[sq] in TRIANGLE_INDEX] for sq in range(64)]
+
+def tableSize(pieces):
+    return 2 * (64 if 'P' in pieces else 10) * 64 ** (1 + len(pieces))
+
+# Index of a position with the stronger side as white. Symmetric positions share the lowest of their indices
+def positionIndex(pieces, strongToMove, strongKing, weakKing, squares):
+    side = 0 if strongToMove else 1
+    if 'P' in pieces:
+        index = (side * 64 + weakKing) * 64 + strongKing
+        for sq in squares:
+            index = index * 64 + sq
+        return index
+    best = -1
+    for t in KING_TRANSFORMS[weakKing]:
+        index = (side * 10 + TRIANGLE_INDEX[t[weakKing]]) * 64 + t[strongKing]
+        for sq in squares:
+            index = index * 64 + t[sq]
+        if best < 0 or index < best:
+            best = index
+    return best
+
+def decodeIndex(pieces, index):
+    squares = []
+    for _ in pieces:
+        squares.append(index % 64)
+        index //= 64
+    squares.reverse()
+    strongKing = index % 64
+    index //= 64
+    if 'P' in pieces:
+        return index // 64 == 0, strongKing, index % 64, squares
+    return index // 10 == 0, strongKing, TRIANGLE[index % 10], squares
+
+def pieceAttacks(piece, sq, occupied):
+    if piece == 'N':
+        return KNIGHT_ATTACKS[sq]
+    if piece == 'P':
+        return PAWN_ATTACKS['w'][sq]
+    attacks = 0
+    if piece in 'QR':
+        attacks |= slidingAttacks(sq, occupied, ROOK_RAYS)
+    if piece in 'QB':
+        attacks |= slidingAttacks(sq, occupied, BISHOP_RAYS)
+    return attacks
+
+def isWeakKingAttacked(pieces, strongKing, weakKing, squares):
+    occupied = 1 << strongKing | 1 << weakKing
+    for sq in squares:
+        occupied |= 1 << sq
+    if KING_ATTACKS[strongKing] >> weakKing & 1:
+        return True
+    for piece, sq in zip(pieces, squares):
+        if pieceAttacks(piece, sq, occupied) >> weakKing & 1:
+            return True
+    return False
+
+# Squares a piece can have come from. Sliders and knights move the same way back, pawns step back down the board
+def retractions(piece, sq, occupied):
+    if piece != 'P':
+        return pieceAttacks(piece, sq, occupied) & ~occupied
+    origins = 0
+    if sq < 48 and not occupied >> (sq + 8) & 1:
+        origins |= 1 << (sq + 8)
+        if sq // 8 == 4 and not occupied >> (sq + 16) & 1:
+            origins |= 1 << (sq + 16)
+    return origins
+
+def bitSquares(bits):
+    while bits:
+        bit = bits & -bits
+        bits ^= bit
+        yield bit.bit_length() - 1
+
+def generate(name, tables):
+    pieces = MATERIALS[name]
+    size = tableSize(pieces)
+    half = size // 2
+    values = bytearray(b'\xff') * size
+    counts = bytearray(size)
+    buckets = {0: array('q')}
+    promotionWins = {} # Positions won by promoting, by plies to mate
+    hasPawn = 'P' in pieces
+    promotions = tables.get('KQK') if hasPawn else None
+
+    # Every legal position: mates seed the search, the weaker side's positions get the number of moves left to refute
+    for weakKing in (range(64) if hasPawn else TRIANGLE):
+        for strongKing in range(64):
+            if strongKing == weakKing or KING_ATTACKS[weakKing] >> strongKing & 1:
+                continue
+            for squares in itertools.product(range(64), repeat=len(pieces)):
+                used = 1 << strongKing | 1 << weakKing
+                for sq in squares:
+                    used |= 1 << sq
+                if bin(used).count('1') != len(pieces) + 2:
+                    continue
+                if hasPawn and any(piece == 'P' and (sq < 8 or sq >= 56) for piece, sq in zip(pieces, squares)):
+                    continue
+                index = positionIndex(pieces, True, strongKing, weakKing, squares)
+                if not hasPawn:
+                    identity = (TRIANGLE_INDEX[weakKing] * 64 + strongKing)
+                    for sq in squares:
+                        identity = identity * 64 + sq
+                    if identity != index: # A symmetric copy of this position is the one stored
+                        continue
+                occupied = used ^ 1 << weakKing
+                attacks = [pieceAttacks(piece, sq, occupied) for piece, sq in zip(pieces, squares)]
+                allAttacks = KING_ATTACKS[strongKing]
+                for pieceAttack in attacks:
+                    allAttacks |= pieceAttack
+                inCheck = allAttacks >> weakKing & 1
+
+                if not inCheck and promotions is not None:
+                    for piece, sq in zip(pieces, squares):
+                        if piece == 'P' and sq < 16 and not used >> (sq - 8) & 1:
+                            result = promotions[positionIndex('Q', False, strongKing, weakKing, [sq - 8])]
+                            if result != DRAW:
+                                promotionWins.setdefault(result + 1, array('q')).append(index)
+
+                successors = set()
+                escape = False
+                for target in bitSquares(KING_ATTACKS[weakKing] & ~(1 << strongKing)):
+                    if used >> target & 1: # Capture, the table ends in a draw if the piece isn't defended
+                        defended = KING_ATTACKS[strongKing]
+                        for sq, pieceAttack in zip(squares, attacks):
+                            if sq != target:
+                                defended |= pieceAttack
+                        if not defended >> target & 1:
+                            escape = True
+                            break
+                    elif not allAttacks >> target & 1:
+                        successors.add(positionIndex(pieces, True, strongKing, target, squares))
+                if escape or (not successors and not inCheck):
+                    counts[half + index] = ESCAPE
+                elif not successors:
+                    values[half + index] = 0
+                    buckets[0].append(half + index)
+                else:
+                    counts[half + index] = len(successors)
+
+    # Retrograde search, one ply at a time so each position is reached first by its shortest mate
+    plies = 0
+    while buckets or promotionWins:
+        for index in promotionWins.pop(plies, ()):
+            addWin(values, buckets, plies, index)
+        for index in buckets.pop(plies, ()):
+            strongToMove, strongKing, weakKing, squares = decodeIndex(pieces, index)
+            occupied = 1 << strongKing | 1 << weakKing
+            for sq in squares:
+                occupied |= 1 << sq
+            if not strongToMove: # Lost for the weaker side, every move into it wins
+                for origin in bitSquares(KING_ATTACKS[strongKing] & ~occupied & ~KING_ATTACKS[weakKing]):
+                    if not isWeakKingAttacked(pieces, origin, weakKing, squares):
+                        addWin(values, buckets, plies + 1, positionIndex(pieces, True, origin, weakKing, squares))
+                for i, (piece, sq) in enumerate(zip(pieces, squares)):
+                    for origin in bitSquares(retractions(piece, sq, occupied)):
+                        previous = squares[:i] + [origin] + squares[i + 1:]
+                        if not isWeakKingAttacked(pieces, strongKing, weakKing, previous):
+                            addWin(values, buckets, plies + 1, positionIndex(pieces, True, strongKing, weakKing, previous))
+            else: # Won for the stronger side, positions whose every move leads to a win are lost
+                predecessors = set()
+                for origin in bitSquares(KING_ATTACKS[weakKing] & ~occupied & ~KING_ATTACKS[strongKing]):
+                    predecessors.add(positionIndex(pieces, False, strongKing, origin, squares))
+                for previous in predecessors:
+                    if values[previous] == DRAW and counts[previous] != ESCAPE:
+                        counts[previous] -= 1
+                        if counts[previous] == 0:
+                            values[previous] = plies + 1
+                            buckets.setdefault(plies + 1, array('q')).append(previous)
+        plies += 1
+    return values
+
+def addWin(values, buckets, plies, index):
+    if values[index] == DRAW:
+        values[index] = plies
+        buckets.setdefault(plies, array('q')).append(index)
+
+def generateTables(names, directory):
+    os.makedirs(directory, exist_ok=True)
+    tables = {}
+    for name in names:
+        if name == 'KPK' and 'KQK' not in tables: # Promotions are looked up in KQK
+            path = os.path.join(directory, 'KQK.tb')
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    tables['KQK'] = f.read()
+            else:
+                names = ['KQK'] + [n for n in names if n != 'KQK']
+                return generateTables(names, directory)
+        start = time.time()
+        tables[name] = generate(name, tables)
+        with open(os.path.join(directory, name + '.tb'), 'wb') as f:
+            f.write(tables[name])
+        values = tables[name]
+        print(name + ": " + str(len(values)) + " positions, longest mate " + str(max(v for v in set(values) if v != DRAW)) +
+              " plies, " + str(round(time.time() - start, 1)) + "s")
+    return tables
+
+class Tablebases():
+    def __init__(self, directory):
+        self.tables = {}
+        self.files = []
+        for name, pieces in MATERIALS.items():
+            path = os.path.join(directory, name + '.tb')
+            if os.path.exists(path):
+                f = open(path, 'rb')
+                if os.fstat(f.fileno()).st_size != tableSize(pieces):
+                    f.close()
+                    raise ValueError("Wrong size for tablebase " + path)
+                self.files.append(f)
+                self.tables[name] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        for table in self.tables.values():
+            table.close()
+        for f in self.files:
+            f.close()
+
+    # (result, plies) for the side to move: result is 1 when it mates in plies, -1 when it gets mated, 0 for a draw.
+    # None if the position isn't covered
+    def probe(self, gs):
+        squares = pieceSquares(gs)
+        if squares is None:
+            return None
+        white = [piece[1] for piece in squares if piece[0] == 'w' for _ in squares[piece]]
+        black = [piece[1] for piece in squares if piece[0] == 'b' for _ in squares[piece]]
+        if len(white) > 1 and len(black) > 1 or white.count('K') != 1 or black.count('K') != 1:
+            return None
+        strong = 'w' if len(white) > 1 else 'b'
+        name = 'K' + ''.join(sorted((piece for piece in (white if strong == 'w' else black) if piece != 'K'), key=PIECE_ORDER.index)) + 'K'
+        if name not in self.tables:
+            return None
+        flip = 0 if strong == 'w' else 56 # Black's material is looked up mirrored onto white's side of the board
+        weak = 'b' if strong == 'w' else 'w'
+        pieceSquareList = [squares[strong + piece][0] ^ flip for piece in MATERIALS[name]]
+        strongToMove = gs.whiteToMove == (strong == 'w')
+        value = self.tables[name][positionIndex(MATERIALS[name], strongToMove, squares[strong + 'K'][0] ^ flip, squares[weak + 'K'][0] ^ flip, pieceSquareList)]
+        if value == DRAW:
+            return 0, 0
+        return (1 if value % 2 == 1 else -1), value
+
+# Square indexes of every piece, None when there are too many pieces for a table
+def pieceSquares(gs):
+    squares = {}
+    if hasattr(gs, 'bitboards'):
+        if bin(gs.occupancy['w'] | gs.occupancy['b']).count('1') > MAX_PIECES:
+            return None
+        for piece in PIECES:
+            bits = gs.bitboards[piece]
+            if bits:
+                squares[piece] = list(bitSquares(bits))
+        return squares
+    occupied = [sq for sq in range(64) if gs.board[SQUARE120[sq]] != EMPTY]
+    if len(occupied) > MAX_PIECES:
+        return None
+    for sq in occupied:
+        squares.setdefault(PIECE_NAMES[gs.board[SQUARE120[sq]]], []).append(sq)
+    return squares
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate endgame tablebases by retrograde analysis")
+    parser.add_argument('tables', nargs='*', choices=list(MATERIALS), default=list(MATERIALS))
+    parser.add_argument('--output', default="tablebases")
+    args = parser.parse_args(argv)
+    generateTables(args.tables, args.output)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,273 @@
+# Headless matches between two MoveFinder configurations, played in parallel with an SPRT stopping rule.
+# Every opening is played twice with colors swapped, so neither side profits from a lopsided opening
+# Usage: python Tournament.py --test NULL_MOVE_PRUNING=False --base "" --games 2000 --nodes 5000 --workers 4
+#        [--movetime 0.1] [--depth 3] [--elo0 0 --elo1 10] [--alpha 0.05 --beta 0.05] [--openings book.epd] [--output match.json]
+
+import argparse
+import ast
+import json
+import math
+import multiprocessing
+import random
+import sys
+import time
+import ChessEngine
+import MoveFinder
+import TranspositionTable
+from ChessEngine import PAWN, ROOK, QUEEN, BLACK, EMPTY, SQUARE120
+
+MAX_PLIES = 300 # Games still running after this many plies are adjudicated a draw
+OPENING_PLIES = 8 # Random plies played from the start position when no openings file is given
+MAX_OPENING_SCORE = 1.5 # Random openings that leave one side this many pawns ahead are thrown away
+TABLE_MB = 4
+SPRT_PSEUDO_GAMES = 0.5 # Added to each of wins, draws and losses by sprtLLR
+
+# Settings the match decides for both engines: each engine has its own TABLE_MB table and pool workers can't start helpers
+FIXED_SETTINGS = ('WORKERS', 'HASH_SIZE_MB')
+
+# "NAME=value,NAME=value" with Python literals as values
+def parseSettings(text):
+    settings = {}
+    for item in text.split(','):
+        if not item.strip():
+            continue
+        name, value = item.split('=', 1)
+        name = name.strip()
+        if not hasattr(MoveFinder, name):
+            raise ValueError("MoveFinder has no setting " + name)
+        if name in FIXED_SETTINGS:
+            raise ValueError(name + " is the same for both engines in a match")
+        try:
+            settings[name] = ast.literal_eval(value.strip())
+        except (ValueError, SyntaxError):
+            settings[name] = value.strip()
+    return settings
+
+class Engine():
+    def __init__(self, settings, defaults):
+        self.settings = dict(defaults)
+        self.settings.update(settings)
+        self.table = TranspositionTable.TranspositionTable(TABLE_MB) # Each engine keeps its own table
+
+    def findMove(self, gs, validMoves, limits):
+        for name, value in self.settings.items():
+            setattr(MoveFinder, name, value)
+        MoveFinder.transpositionTable = self.table
+        # Limits the match leaves open come from this engine's own DEPTH, TIME_LIMIT and NODE_LIMIT
+        return MoveFinder.findBestMove(gs, validMoves, *MoveFinder.searchLimits(*limits))
+
+workerEngines = None
+workerLimits = None
+
+def initWorker(testSettings, baseSettings, limits):
+    global workerEngines, workerLimits
+    # The openings come from the tournament and cached results of one engine would be played by the other, no book or cache
+    MoveFinder.initPoolWorker()
+    names = set(testSettings) | set(baseSettings)
+    defaults = {name: getattr(MoveFinder, name) for name in names}
+    workerEngines = (Engine(testSettings, defaults), Engine(baseSettings, defaults))
+    workerLimits = limits
+
+# No side can mate: no pawns, rooks or queens and at most one minor piece each
+def insufficientMaterial(board):
+    minors = [0, 0]
+    for sq in SQUARE120:
+        piece = board[sq]
+        if piece == EMPTY:
+            continue
+        pieceType = piece - BLACK if piece > BLACK else piece
+        if pieceType in (PAWN, ROOK, QUEEN):
+            return False
+        if pieceType != ChessEngine.KING:
+            minors[piece > BLACK] += 1
+    return minors[0] <= 1 and minors[1] <= 1
+
+# Plays one game from fen, returns the score of the test engine (1, 0.5 or 0), how the game ended and its length
+def playGame(task):
+    gameIndex, fen, testIsWhite = task
+    gs = ChessEngine.GameState()
+    gs.loadFEN(fen)
+    for engine in workerEngines:
+        engine.table.clear()
+    repetitions = {gs.zobristKey: 1}
+    plies = 0
+    while True:
+        validMoves = gs.getValidMoves()
+        if len(validMoves) == 0:
+            if gs.inCheck: # The side to move is mated
+                whiteScore = 0 if gs.whiteToMove else 1
+                reason = 'checkmate'
+            else:
+                whiteScore, reason = 0.5, 'stalemate'
+            break
+        if gs.halfmoveClock >= 100:
+            whiteScore, reason = 0.5, 'fifty moves'
+            break
+        if repetitions[gs.zobristKey] >= 3:
+            whiteScore, reason = 0.5, 'repetition'
+            break
+        if insufficientMaterial(gs.board):
+            whiteScore, reason = 0.5, 'insufficient material'
+            break
+        if plies >= MAX_PLIES:
+            whiteScore, reason = 0.5, 'adjudicated'
+            break
+        engine = workerEngines[0 if gs.whiteToMove == testIsWhite else 1]
+        move = engine.findMove(gs, validMoves, workerLimits)
+        if move is None:
+            move = validMoves[0]
+        gs.makeMove(move)
+        plies += 1
+        if gs.halfmoveClock == 0: # Positions before a capture or pawn move can't come back
+            repetitions = {}
+        repetitions[gs.zobristKey] = repetitions.get(gs.zobristKey, 0) + 1
+    testScore = whiteScore if testIsWhite else 1 - whiteScore
+    return gameIndex, testScore, reason, plies
+
+# Start positions a few random plies deep that are still roughly level and not over
+def randomOpenings(count, plies, rng):
+    openings = []
+    while len(openings) < count:
+        gs = ChessEngine.GameState()
+        for ply in range(plies):
+            moves = gs.generateMoves()
+            if len(moves) == 0:
+                break
+            gs.makeMove(rng.choice(moves))
+        if len(gs.generateMoves()) > 0 and abs(gs.evaluation / 10) <= MAX_OPENING_SCORE:
+            openings.append(gs.getFEN())
+    return openings
+
+def loadOpenings(path):
+    with open(path) as f:
+        return [' '.join(line.split()[:6]) for line in f if line.strip() and not line.startswith('#')]
+
+def expectedScore(elo):
+    return 1 / (1 + 10 ** (-elo / 400))
+
+def eloFromScore(score):
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1 / score - 1)
+
+# Log likelihood ratio of elo1 against elo0 for a win/draw/loss record, with the normal approximation of the trinomial model.
+# Half a game of each result is added so an all-win or all-loss start doesn't have zero variance and still counts
+def sprtLLR(wins, draws, losses, elo0, elo1):
+    if wins + draws + losses == 0:
+        return 0.0
+    wins, draws, losses = wins + SPRT_PSEUDO_GAMES, draws + SPRT_PSEUDO_GAMES, losses + SPRT_PSEUDO_GAMES
+    games = wins + draws + losses
+    score = (wins + draws / 2) / games
+    variance = (wins + draws / 4) / games - score * score
+    score0, score1 = expectedScore(elo0), expectedScore(elo1)
+    return (score1 - score0) * (2 * score - score0 - score1) / (2 * variance / games)
+
+def sprtBounds(alpha, beta):
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+# Elo difference of the test engine and its 95% error margin
+def eloEstimate(wins, draws, losses):
+    games = wins + draws + losses
+    if games == 0:
+        return 0.0, 0.0
+    score = (wins + draws / 2) / games
+    variance = (wins + draws / 4) / games - score * score
+    margin = 1.96 * math.sqrt(max(variance, 0) / games)
+    return eloFromScore(score), (eloFromScore(min(score + margin, 1)) - eloFromScore(max(score - margin, 0))) / 2
+
+def runMatch(testSettings, baseSettings, games, limits, workers, elo0, elo1, alpha, beta, openings, seed, progress=None):
+    rng = random.Random(seed)
+    pairs = (games + 1) // 2
+    if openings is None:
+        openings = randomOpenings(pairs, OPENING_PLIES, rng)
+    else:
+        rng.shuffle(openings)
+    tasks = []
+    for pair in range(pairs):
+        fen = openings[pair % len(openings)]
+        tasks.append((2 * pair, fen, True))
+        tasks.append((2 * pair + 1, fen, False))
+    tasks = tasks[:games]
+    lower, upper = sprtBounds(alpha, beta)
+    wins = draws = losses = 0
+    reasons = {}
+    decision = None
+    llr = 0.0
+    startTime = time.time()
+    pool = multiprocessing.Pool(workers, initializer=initWorker, initargs=(testSettings, baseSettings, limits))
+    try:
+        for gameIndex, testScore, reason, plies in pool.imap_unordered(playGame, tasks):
+            if testScore == 1:
+                wins += 1
+            elif testScore == 0:
+                losses += 1
+            else:
+                draws += 1
+            reasons[reason] = reasons.get(reason, 0) + 1
+            llr = sprtLLR(wins, draws, losses, elo0, elo1)
+            if progress is not None:
+                progress(wins, draws, losses, llr, lower, upper)
+            if llr >= upper:
+                decision = 'H1' # The test engine is at least elo1 stronger
+                break
+            if llr <= lower:
+                decision = 'H0' # It is not better than elo0
+                break
+    finally:
+        pool.terminate()
+        pool.join()
+    elo, margin = eloEstimate(wins, draws, losses)
+    return {'test': testSettings, 'base': baseSettings, 'games': wins + draws + losses, 'wins': wins, 'draws': draws,
+            'losses': losses, 'elo': round(elo, 1), 'eloMargin': round(margin, 1), 'llr': round(llr, 3),
+            'bounds': [round(lower, 3), round(upper, 3)], 'elo0': elo0, 'elo1': elo1, 'decision': decision,
+            'endings': reasons, 'seconds': round(time.time() - startTime, 1)}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Match two MoveFinder configurations with an SPRT stopping rule")
+    parser.add_argument('--test', default='', help="Settings of the engine under test, e.g. NULL_MOVE_PRUNING=False,DELTA_MARGIN=3")
+    parser.add_argument('--base', default='', help="Settings of the reference engine, MoveFinder defaults when empty")
+    parser.add_argument('--games', type=int, default=1000, help="Most games to play if SPRT doesn't decide first")
+    parser.add_argument('--nodes', type=int, help="Nodes per move")
+    parser.add_argument('--movetime', type=float, help="Seconds per move")
+    parser.add_argument('--depth', type=int, help="Depth per move, each engine's DEPTH when no limit is given")
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--elo0', type=float, default=0)
+    parser.add_argument('--elo1', type=float, default=10)
+    parser.add_argument('--alpha', type=float, default=0.05)
+    parser.add_argument('--beta', type=float, default=0.05)
+    parser.add_argument('--openings', help="File of FENs (EPD works too) to start games from instead of random openings")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="Write the JSON report to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    try:
+        testSettings = parseSettings(args.test)
+        baseSettings = parseSettings(args.base)
+    except ValueError as error:
+        parser.error(str(error))
+    limits = (args.depth, args.movetime, args.nodes)
+    # A limit given for the match would silently override the same setting of either engine
+    overridden = {'DEPTH': args.depth is not None or args.movetime is not None or args.nodes is not None,
+                  'TIME_LIMIT': args.movetime is not None, 'NODE_LIMIT': args.nodes is not None}
+    for name in set(testSettings) | set(baseSettings):
+        if overridden.get(name):
+            parser.error(name + " can't be set per engine together with the match's --depth, --movetime or --nodes")
+    openings = loadOpenings(args.openings) if args.openings else None
+
+    def progress(wins, draws, losses, llr, lower, upper):
+        sys.stderr.write("\r+" + str(wins) + " =" + str(draws) + " -" + str(losses) + "  LLR " + format(llr, '.2f') +
+                         " [" + format(lower, '.2f') + ", " + format(upper, '.2f') + "]")
+        sys.stderr.flush()
+
+    report = runMatch(testSettings, baseSettings, args.games, limits, args.workers, args.elo0, args.elo1, args.alpha, args.beta,
+                      openings, args.seed, progress)
+    sys.stderr.write("\n")
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
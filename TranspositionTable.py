@@ -0,0 +1,65 @@
+# Fixed size transposition table. Entries live in a preallocated array of 64-bit words, so memory stays flat however long the game runs
+
+EXACT = 0
+LOWER_BOUND = 1 # Score failed high, real score is at least this
+UPPER_BOUND = 2 # Score failed low, real score is at most this
+
+ENTRY_WORDS = 2 # key ^ data, data
+BUCKET_ENTRIES = 2 # Slot 0 is depth-preferred, slot 1 is always-replace
+SCORE_SCALE = 10 # Scores are stored as integers in tenths of a pawn
+SCORE_OFFSET = 1 << 19
+
+# data word layout: move (32 bits) | score + SCORE_OFFSET (20 bits) | depth (8 bits) | age (2 bits) | bound (2 bits)
+def packEntry(depth, score, bound, move, age):
+    return move << 32 | (int(round(score * SCORE_SCALE)) + SCORE_OFFSET) << 12 | depth << 4 | age << 2 | bound
+
+def tableBytes(sizeMB):
+    return max(1, sizeMB * 1024 * 1024 // (8 * ENTRY_WORDS * BUCKET_ENTRIES)) * 8 * ENTRY_WORDS * BUCKET_ENTRIES
+
+class TranspositionTable():
+    # buffer lets several processes share one table, e.g. the buf of a multiprocessing.shared_memory block
+    def __init__(self, sizeMB=16, buffer=None):
+        self.sizeMB = sizeMB
+        self.bucketCount = tableBytes(sizeMB) // (8 * ENTRY_WORDS * BUCKET_ENTRIES)
+        if buffer is None:
+            buffer = bytearray(tableBytes(sizeMB))
+        self.table = memoryview(buffer)[:tableBytes(sizeMB)].cast('Q')
+        self.age = 0
+
+    # A shared memory block can only be closed once no view of it is left
+    def release(self):
+        self.table.release()
+
+    def clear(self):
+        self.table[:] = memoryview(bytes(len(self.table) * 8)).cast('Q')
+        self.age = 0
+
+    # Entries from older searches may be overwritten by shallower ones
+    def newSearch(self):
+        self.age = (self.age + 1) & 3
+
+    # Returns (depth, score, bound, move) or None. The key is stored XORed with the data so a torn entry never matches
+    def probe(self, key):
+        table = self.table
+        index = (key % self.bucketCount) * ENTRY_WORDS * BUCKET_ENTRIES
+        for i in (index, index + ENTRY_WORDS):
+            data = table[i + 1]
+            if table[i] ^ data == key:
+                return (data >> 4) & 0xFF, (((data >> 12) & 0xFFFFF) - SCORE_OFFSET) / SCORE_SCALE, data & 3, data >> 32
+        return None
+
+    def store(self, key, depth, score, bound, move):
+        table = self.table
+        index = (key % self.bucketCount) * ENTRY_WORDS * BUCKET_ENTRIES
+        data = table[index + 1]
+        storedDepth = (data >> 4) & 0xFF
+        storedAge = (data >> 2) & 3
+        if table[index] ^ data == key or depth >= storedDepth or storedAge != self.age:
+            slot = index
+        else:
+            slot = index + ENTRY_WORDS
+        if move == 0 and table[slot] ^ table[slot + 1] == key: # Keep the best move of a previous search of this position
+            move = table[slot + 1] >> 32
+        data = packEntry(depth, score, bound, move, self.age)
+        table[slot] = key ^ data
+        table[slot + 1] = data
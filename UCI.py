@@ -0,0 +1,188 @@
+# UCI front end for tournament managers and GUIs, no display or pygame needed
+# Usage: python UCI.py, then speak UCI over stdin/stdout
+
+import os
+import sys
+import threading
+import ChessEngine
+import MoveFinder
+
+ENGINE_NAME = "Chess Engine"
+ENGINE_AUTHOR = "Chess Engine authors"
+MOVES_TO_GO = 30 # Moves left in the game assumed when the GUI doesn't say
+MOVE_OVERHEAD = 50 # Milliseconds kept back per move for the GUI and process latency
+MAX_HASH_MB = 1024
+
+def uciNotation(move):
+    text = move.getRankFile(move.startRow, move.startCol) + move.getRankFile(move.endRow, move.endCol)
+    return text + 'q' if move.pawnPromotion else text
+
+# The legal move a UCI string names, None if there is none. The engine only promotes to a queen
+def moveFromUCI(text, validMoves):
+    if len(text) < 4 or text[0] not in 'abcdefgh' or text[2] not in 'abcdefgh' or text[1] not in '12345678' or \
+            text[3] not in '12345678':
+        return None
+    startRow, startCol = ChessEngine.Move.ranksToRows[text[1]], ChessEngine.Move.filesToCols[text[0]]
+    endRow, endCol = ChessEngine.Move.ranksToRows[text[3]], ChessEngine.Move.filesToCols[text[2]]
+    promotion = text[4:5]
+    for move in validMoves:
+        if move.startRow == startRow and move.startCol == startCol and move.endRow == endRow and move.endCol == endCol:
+            if move.pawnPromotion and promotion != 'q':
+                return None
+            return move
+    return None
+
+# Seconds to spend on this move from the go parameters, None to search without a clock
+def timeForMove(params, whiteToMove):
+    if 'movetime' in params:
+        return max(params['movetime'] - MOVE_OVERHEAD, 1) / 1000
+    remaining = params.get('wtime' if whiteToMove else 'btime')
+    if remaining is None:
+        return None
+    increment = params.get('winc' if whiteToMove else 'binc', 0)
+    movesToGo = params.get('movestogo', MOVES_TO_GO)
+    budget = remaining / max(movesToGo, 1) + increment * 3 / 4
+    return max(min(budget, remaining - MOVE_OVERHEAD), 1) / 1000
+
+def scoreText(score, pvLength):
+    if abs(score) >= MoveFinder.CHECKMATE: # Mates are scored without their distance, the line to the mate tells it
+        mateIn = (pvLength + 1) // 2
+        return "mate " + str(mateIn if score > 0 else -mateIn)
+    return "cp " + str(round(score * 100))
+
+class UCIEngine():
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self.outputLock = threading.Lock()
+        self.gs = ChessEngine.GameState()
+        self.searchThread = None
+        self.stopEvent = threading.Event()
+        MoveFinder.stopSignal = self.stopEvent
+
+    def send(self, line):
+        with self.outputLock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    # Handles one line of input, False once the GUI said quit
+    def command(self, line):
+        tokens = line.split()
+        if not tokens:
+            return True
+        name, args = tokens[0], tokens[1:]
+        if name == 'uci':
+            self.send("id name " + ENGINE_NAME)
+            self.send("id author " + ENGINE_AUTHOR)
+            self.send("option name Hash type spin default " + str(MoveFinder.HASH_SIZE_MB) + " min 1 max " + str(MAX_HASH_MB))
+            self.send("option name Threads type spin default " + str(MoveFinder.WORKERS) + " min 1 max " + str(os.cpu_count() or 1))
+            self.send("uciok")
+        elif name == 'isready':
+            self.send("readyok")
+        elif name == 'setoption':
+            self.stopSearch()
+            self.setOption(args)
+        elif name == 'ucinewgame':
+            self.stopSearch()
+            MoveFinder.transpositionTable.clear()
+        elif name == 'position':
+            self.stopSearch()
+            self.setPosition(args)
+        elif name == 'go':
+            self.stopSearch()
+            self.go(args)
+        elif name == 'stop':
+            self.stopSearch()
+        elif name == 'quit':
+            self.stopSearch()
+            return False
+        return True
+
+    def setOption(self, args):
+        if 'name' not in args:
+            return
+        valueIndex = args.index('value') if 'value' in args else len(args)
+        option = ' '.join(args[args.index('name') + 1:valueIndex]).lower()
+        value = ' '.join(args[valueIndex + 1:])
+        try:
+            if option == 'hash':
+                MoveFinder.setHashSize(min(max(int(value), 1), MAX_HASH_MB))
+            elif option == 'threads':
+                MoveFinder.WORKERS = max(int(value), 1)
+            else:
+                self.send("info string unknown option " + option)
+        except ValueError:
+            self.send("info string invalid value " + value + " for " + option)
+
+    # position startpos|fen <fen> [moves <move> ...]
+    def setPosition(self, args):
+        movesIndex = args.index('moves') if 'moves' in args else len(args)
+        if args[:1] == ['fen']:
+            fen = ' '.join(args[1:movesIndex])
+        else:
+            fen = ChessEngine.START_FEN
+        gs = ChessEngine.GameState()
+        try:
+            gs.loadFEN(fen)
+        except (ValueError, KeyError, IndexError):
+            self.send("info string invalid fen " + fen)
+            return
+        for text in args[movesIndex + 1:]:
+            move = moveFromUCI(text, gs.getValidMoves())
+            if move is None:
+                self.send("info string illegal move " + text)
+                break
+            gs.makeMove(move)
+        self.gs = gs
+
+    def go(self, args):
+        params = {}
+        for i in range(len(args) - 1):
+            if args[i] in ('wtime', 'btime', 'winc', 'binc', 'movestogo', 'movetime', 'depth', 'nodes'):
+                try:
+                    params[args[i]] = int(args[i + 1])
+                except ValueError:
+                    pass
+        infinite = 'infinite' in args
+        timeLimit = None if infinite else timeForMove(params, self.gs.whiteToMove)
+        maxDepth = params.get('depth', MoveFinder.MAX_SEARCH_DEPTH)
+        nodeLimit = params.get('nodes')
+        self.stopEvent.clear()
+        self.searchThread = threading.Thread(target=self.search, args=(maxDepth, timeLimit, nodeLimit, infinite), daemon=True)
+        self.searchThread.start()
+
+    def search(self, maxDepth, timeLimit, nodeLimit, infinite):
+        validMoves = self.gs.getValidMoves()
+        if len(validMoves) == 0:
+            bestMove = None
+        else:
+            bestMove, stats = MoveFinder.findBestMoveWithStats(self.gs, validMoves, maxDepth, timeLimit, nodeLimit,
+                                                              onProgress=self.sendInfo)
+            if stats is not None and stats.source != 'search':
+                self.send("info string " + stats.source + " move")
+            if bestMove is None: # Stopped before any depth finished
+                bestMove = validMoves[0]
+        if infinite: # The GUI decides when an infinite search ends
+            self.stopEvent.wait()
+        self.send("bestmove " + (uciNotation(bestMove) if bestMove is not None else "0000"))
+
+    def sendInfo(self, stats):
+        pv = [uciNotation(ChessEngine.Move.fromPacked(move)) for move in stats.pv]
+        self.send("info depth " + str(stats.depth) + " score " + scoreText(stats.score, len(pv)) + " nodes " + str(stats.nodes) +
+                  " nps " + str(stats.nodesPerSecond()) + " time " + str(int(stats.seconds * 1000)) + " pv " + ' '.join(pv))
+
+    def stopSearch(self):
+        if self.searchThread is not None:
+            self.stopEvent.set()
+            self.searchThread.join()
+            self.searchThread = None
+
+def main():
+    engine = UCIEngine()
+    for line in sys.stdin:
+        if not engine.command(line):
+            break
+    engine.stopSearch()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())